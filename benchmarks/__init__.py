@@ -0,0 +1,5 @@
+"""
+Benchmarks of the simulation hot path, run with
+
+python -m benchmarks.run [--quick] [--save baseline.json] [--compare baseline.json] [--tolerance 0.25]
+"""
@@ -0,0 +1,111 @@
+"""
+Benchmark cases of the entry points of the simulation on the config template and the modules_config of the tests.
+"""
+import copy
+
+from ruamel.yaml import YAML
+
+import fup.profiles
+import fup.utils.simulation_utils
+from fup.core.functions import get_blueprint
+from fup.core.manager import Manager
+from fup.utils.plot_utils import create_plot
+from fup.utils.simulation_utils import get_sorted_module_blueprints, run_simulations
+
+
+class Case:
+    """
+    A benchmark: setup() prepares and returns the function to time, runs x years are simulated by one call.
+    """
+
+    def __init__(self, name, setup, runs=1, years=None):
+        self.name = name
+        self.setup = setup
+        self.runs = runs
+        self.years = years
+
+
+def load_config(name, years=None):
+    if name == "template":
+        with open("config_template.yaml") as f:
+            config = YAML(typ="safe").load(f)
+    else:
+        from tests.conftest import get_modules_config
+        config = get_modules_config()
+    config["simulation"]["random"] = True
+    config["simulation"]["seed"] = 42
+    if years is not None:
+        config["simulation"]["end_year"] = config["simulation"]["start_year"] + years
+    return config
+
+
+def get_years(config):
+    return config["simulation"]["end_year"] - config["simulation"]["start_year"]
+
+
+def next_year_case(config, runs=None):
+    def setup():
+        manager = Manager(config=config,
+                          module_blueprints=get_sorted_module_blueprints(config),
+                          profile_blueprint=get_blueprint(config=config["profile"], root_module=fup.profiles),
+                          current_account_name="CurrentAccount", runs=runs)
+        snapshot = manager.snapshot()
+
+        def run():
+            manager.restore(snapshot)
+            for _ in range(get_years(config)):
+                manager.next_year()
+        return run
+    return setup
+
+
+def run_simulations_case(config, runs, batch):
+    def setup():
+        return lambda: run_simulations(config=config, runs=runs, batch=batch, as_dataframe=False)
+    return setup
+
+
+def sorted_module_blueprints_case(config, cached):
+    def setup():
+        get_sorted_module_blueprints(config)
+
+        def run():
+            if not cached:
+                fup.utils.simulation_utils._sorted_module_names_cache.clear()
+            get_sorted_module_blueprints(config)
+        return run
+    return setup
+
+
+def create_plot_case(config, runs):
+    def setup():
+        df, _ = run_simulations(config=config, runs=runs, batch=True)
+        return lambda: create_plot(df, column="assets_cor", name="Assets", unit="€", color="green")
+    return setup
+
+
+def get_cases(quick=False):
+    cases = []
+    horizons = [10, None]  # None: horizon of the config
+    serial_runs = [10] if quick else [10, 100]
+    batch_runs = [100] if quick else [1000, 10000]
+    for config_name in ["template", "modules"]:
+        for horizon in horizons:
+            config = load_config(config_name, years=horizon)
+            years = get_years(config)
+            prefix = f"{config_name}/{years}y"
+            cases += [Case(f"{prefix}/next_year", next_year_case(config), years=years),
+                      Case(f"{prefix}/next_year_batch_{batch_runs[0]}", next_year_case(config, runs=batch_runs[0]),
+                           runs=batch_runs[0], years=years)]
+            for runs in serial_runs:
+                cases += [Case(f"{prefix}/run_simulations_{runs}", run_simulations_case(config, runs, batch=False),
+                               runs=runs, years=years)]
+            for runs in batch_runs:
+                cases += [Case(f"{prefix}/run_simulations_batch_{runs}",
+                               run_simulations_case(config, runs, batch=True), runs=runs, years=years)]
+        config = load_config(config_name)
+        cases += [Case(f"{config_name}/sorted_module_blueprints", sorted_module_blueprints_case(config, cached=False)),
+                  Case(f"{config_name}/sorted_module_blueprints_cached",
+                       sorted_module_blueprints_case(config, cached=True)),
+                  Case(f"{config_name}/create_plot", create_plot_case(copy.deepcopy(config), runs=batch_runs[0]))]
+    return cases
@@ -0,0 +1,61 @@
+"""
+Convergence of plain Monte-Carlo against the variance reductions (simulation: antithetic, qmc) on the config template:
+the spread of the estimates over independent repetitions (seeds) for increasing numbers of runs.
+
+python -m benchmarks.convergence [--config config_template.yaml] [--runs 128 512 2048] [--repetitions 16]
+The efficiency is the number of plain Monte-Carlo runs one run of the mode is worth, (std MC / std mode)**2.
+"""
+import argparse
+import copy
+
+import numpy as np
+import pandas as pd
+from ruamel.yaml import YAML
+
+from fup.utils.simulation_utils import run_simulations
+
+modes = {
+    "mc": dict(),
+    "antithetic": dict(antithetic=True),
+    "qmc": dict(qmc=True),
+}
+
+estimators = {
+    "assets_cor median end": lambda result: np.median(result["assets_cor"][:, -1]),
+    "assets_cor mean end": lambda result: np.mean(result["assets_cor"][:, -1]),
+    "income_net_cor mean": lambda result: np.mean(result["income_net_cor"]),
+}
+
+
+def get_estimates(config, mode, runs, repetitions):
+    estimates = []
+    for seed in range(repetitions):
+        mode_config = copy.deepcopy(config)
+        mode_config["simulation"].update(random=True, seed=seed, **modes[mode])
+        result, _ = run_simulations(config=mode_config, runs=runs, batch=True, as_dataframe=False)
+        estimates += [{name: estimator(result) for name, estimator in estimators.items()}]
+    return pd.DataFrame(estimates)
+
+
+def main(config_path="config_template.yaml", runs=(128, 512, 2048), repetitions=16):
+    with open(config_path) as f:
+        config = YAML(typ="safe").load(f)
+    rows = []
+    for n_runs in runs:
+        stds = {mode: get_estimates(config, mode, n_runs, repetitions).std(ddof=1) for mode in modes}
+        for mode, std in stds.items():
+            for name in estimators:
+                rows += [dict(runs=n_runs, mode=mode, estimate=name, std=std[name],
+                              efficiency=(stds["mc"][name] / std[name]) ** 2 if std[name] > 0 else np.inf)]
+    df = pd.DataFrame(rows)
+    print(df.pivot_table(index=["estimate", "runs"], columns="mode", values="efficiency")[list(modes)].round(2))
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config_template.yaml")
+    parser.add_argument("--runs", type=int, nargs="+", default=[128, 512, 2048])
+    parser.add_argument("--repetitions", type=int, default=16)
+    args = parser.parse_args()
+    main(config_path=args.config, runs=args.runs, repetitions=args.repetitions)
@@ -0,0 +1,69 @@
+"""
+Micro-benchmark of the accessors linked to other modules against the lookups by name (get_prop) on the config template.
+
+python -m benchmarks.prop_access [--config config_template.yaml] [--number 100000]
+"""
+import argparse
+import timeit
+
+from ruamel.yaml import YAML
+
+import fup.profiles
+from fup.core.functions import get_blueprint
+from fup.core.manager import Manager
+from fup.utils.simulation_utils import get_sorted_module_blueprints
+
+
+def get_manager(config):
+    return Manager(config=config,
+                   module_blueprints=get_sorted_module_blueprints(config),
+                   profile_blueprint=get_blueprint(config=config["profile"], root_module=fup.profiles),
+                   current_account_name="CurrentAccount")
+
+
+def time_per_call(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def main(config_path="config_template.yaml", number=100000):
+    with open(config_path) as f:
+        config = YAML(typ="safe").load(f)
+    manager = get_manager(config)
+
+    unemployment = manager.get_module("main.insurances.Unemployment")
+    props = [("main.work.Job", "salary_per_month"),
+             ("main.work.Job", "income"),
+             ("main.work.Job", "unemployed_months"),
+             ("main.work.Job", "unemployed_months_this_year"),
+             ("main.environment.Inflation", "inflation")]
+    getters = [unemployment.get_salary_per_month, unemployment.get_job_income, unemployment.get_unemployed_months,
+               unemployment.get_unemployed_months_this_year, unemployment.get_inflation]
+    crisis = manager.get_module("events.crisis.OilCrisis1973")
+    multiply_prob_lose_job = crisis.multipliers[crisis.table.targets.index(("main.work.Job", "prob_lose_job"))]
+
+    benchmarks = {
+        "Unemployment reads, get_prop": lambda: [unemployment.get_prop(*prop) for prop in props],
+        "Unemployment reads, linked": lambda: [get() for get in getters],
+        "crisis multiplier, get_prop_multiplier": lambda: crisis.get_prop_multiplier("main.work.Job",
+                                                                                     "prob_lose_job")(1),
+        "crisis multiplier, linked": lambda: multiply_prob_lose_job(1),
+    }
+    for name, function in benchmarks.items():
+        print(f"{name:<45} {time_per_call(function, number):8.3f} µs")
+
+    n_years = config["simulation"]["end_year"] - config["simulation"]["start_year"]
+    snapshot = manager.snapshot()
+
+    def run():
+        manager.restore(snapshot)
+        for _ in range(n_years):
+            manager.next_year()
+    print(f"{'one run, ' + str(n_years) + ' years':<45} {time_per_call(run, 20) / 1000:8.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--config", default="config_template.yaml")
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+    main(config_path=args.config, number=args.number)
@@ -0,0 +1,101 @@
+"""
+Run the benchmarks, save the results as json baseline and compare them with a saved baseline.
+
+python -m benchmarks.run [--quick] [--filter name] [--save baseline.json] [--compare baseline.json] [--tolerance 0.25]
+Exits with 1 if a benchmark got slower or needs more memory than the baseline beyond the tolerance.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.cases import get_cases
+
+
+def measure(case, repeat=3):
+    """
+    Best time of repeat calls, and the peak memory of one call (traced separately, tracing slows down).
+    """
+    run = case.setup()
+    times = []
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        run()
+        times += [time.perf_counter() - time_start]
+    seconds = min(times)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = dict(seconds=seconds, peak_mb=peak / 2 ** 20)
+    if case.years is not None:
+        result["runs_per_sec"] = case.runs / seconds
+        result["year_latency_ms"] = seconds / case.years * 1e3
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Names and ratios of the benchmarks slower or with a higher peak memory than baseline * (1 + tolerance).
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline or "error" in result or "error" in baseline[name]:
+            continue
+        for metric in ["seconds", "peak_mb"]:
+            ratio = result[metric] / max(baseline[name][metric], 1e-12)
+            if ratio > 1 + tolerance:
+                regressions += [(name, metric, ratio)]
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="fewer runs and repeats")
+    parser.add_argument("--filter", default="", help="only benchmarks containing this")
+    parser.add_argument("--save", help="save the results as json baseline")
+    parser.add_argument("--compare", help="compare with this json baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative regression tolerance")
+    args = parser.parse_args(args)
+
+    results = dict()
+    for case in get_cases(quick=args.quick):
+        if args.filter not in case.name:
+            continue
+        try:
+            results[case.name] = measure(case, repeat=1 if args.quick else 3)
+        except Exception as error:  # e.g. an incompatible bokeh version for create_plot
+            results[case.name] = dict(error=repr(error))
+        result = results[case.name]
+        if "error" in result:
+            print(f"{case.name:<55} error: {result['error']}")
+        else:
+            rate = f"{result['runs_per_sec']:10.1f} runs/s {result['year_latency_ms']:9.3f} ms/year" \
+                if "runs_per_sec" in result else " " * 36
+            print(f"{case.name:<55} {result['seconds']:9.4f} s {rate} {result['peak_mb']:8.1f} MB")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(dict(python=platform.python_version(), numpy=np.__version__, machine=platform.machine(),
+                           processor=platform.processor(), results=results), f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, tolerance=args.tolerance)
+        for name, metric, ratio in regressions:
+            print(f"REGRESSION {name} {metric}: {ratio:.2f} x baseline")
+        if regressions:
+            return 1
+        print(f"no regressions beyond {args.tolerance:.0%} of {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
 class BluePrint:
-    def __init__(self, build_config, build_class, name="", run_end_of_year=False):
+    def __init__(self, build_config, build_class, name="", run_end_of_year=False, feedback_free=False):
         self.run_end_of_year = run_end_of_year
+        # no inputs from other modules and not modified by them, see get_feedback_free_module_names
+        self.feedback_free = feedback_free
         self.name = name
         self.build_config = build_config
         self.build_class = build_class
@@ -1,9 +1,18 @@
 import copy
-import inspect
+import importlib.metadata
+
+import numpy as np
 
 from fup.core.config import BluePrint
 
 
+def where(condition, x, y):
+    # np.where for batch managers, plain python values for single runs
+    if isinstance(condition, (bool, np.bool_)):
+        return x if condition else y
+    return np.where(condition, x, y)
+
+
 def get_full_class_name(module):
     module_name = module.__module__
     class_name = module.__name__
@@ -17,28 +26,53 @@ def get_full_class_name(module):
     return module_name + "." + class_name
 
 
-def get_all_modules(root_module, classes=None, module_name=None):
-    if classes is None:
-        classes = dict()
+_class_registry = dict()  # full class name -> class, filled on import of the classes
+_plugin_classes = dict()  # (entry point group, name) -> class, filled when referenced in a config
+
+
+def register_class(cls):
+    """
+    Make a class available in configs by its full class name. Module subclasses are registered automatically.
+    """
+    _class_registry[get_full_class_name(cls)] = cls
+    return cls
 
-    if module_name is None:
-        module_name = root_module.__name__
 
-    for name, obj in inspect.getmembers(root_module):
-        if inspect.isclass(obj) and obj.__module__.startswith(module_name):
-            classes[get_full_class_name(obj)] = obj
-        if inspect.ismodule(obj) and obj.__name__.startswith(module_name):
-            get_all_modules(root_module=obj, classes=classes, module_name=module_name)
+def get_entry_points(group):
+    entry_points = importlib.metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return entry_points.select(group=group)
+    return entry_points.get(group, [])
+
+
+def get_class(class_name, root_module):
+    """
+    Look up a registered class below root_module. Classes of plugin packages, announced as entry points in the
+    group named like root_module (e.g. fup.modules), are only imported once their name is looked up.
+    """
+    build_class = _class_registry.get(class_name)
+    if build_class is not None and build_class.__module__.startswith(root_module.__name__):
+        return build_class
+
+    key = (root_module.__name__, class_name)
+    if key not in _plugin_classes:
+        for entry_point in get_entry_points(group=root_module.__name__):
+            if entry_point.name == class_name:
+                _plugin_classes[key] = entry_point.load()
+                break
+        else:
+            raise KeyError(f"unknown class {class_name} in {root_module.__name__}")
+    return _plugin_classes[key]
+
 
-    return classes
+def get_all_modules(root_module):
+    return {name: cls for name, cls in _class_registry.items() if cls.__module__.startswith(root_module.__name__)}
 
 
 def get_blueprint(config, root_module):
     config = copy.deepcopy(config)
     assert "class" in config
-    all_module_classes = get_all_modules(root_module=root_module)
-    assert config["class"] in all_module_classes, all_module_classes
-    build_class = all_module_classes[config["class"]]
+    build_class = get_class(class_name=config["class"], root_module=root_module)
     del config["class"]
 
     return BluePrint(build_class=build_class, build_config=config)
@@ -46,7 +80,6 @@ def get_blueprint(config, root_module):
 
 def get_module_blueprints(root_module, config):
     config = copy.deepcopy(config)  # FIXME, class and run_end_of_year is "cleaned"
-    standard_modules = get_all_modules(root_module=root_module)
 
     blueprint_list = list()
     for name in config["modules"].keys():
@@ -60,10 +93,10 @@ def get_module_blueprints(root_module, config):
             del build_config["run_end_of_year"]
 
         if "class" in build_config:
-            build_class = standard_modules[build_config["class"]]
+            build_class = get_class(class_name=build_config["class"], root_module=root_module)
             del build_config["class"]
         else:
-            build_class = standard_modules[name]
+            build_class = get_class(class_name=name, root_module=root_module)
 
         blueprint_list += [BluePrint(name=name,
                                      run_end_of_year=run_end_of_year,
@@ -1,45 +1,255 @@
 import collections
 import copy
+import functools
+import types
+
+import numpy as np
+
+from fup.core.module import resolve_current_account
+from fup.core.results import ColumnSchema
+from fup.core.streams import RandomStreams
+
+
+class BatchRow(dict):
+    # modules update their state vectors in place, the row keeps the values of the moment they were written
+    def __setitem__(self, key, value):
+        if isinstance(value, np.ndarray):
+            value = value.copy()
+        super().__setitem__(key, value)
+
+
+class ManagerSnapshot:
+    """
+    State of a built manager, its profile and modules, see Manager.snapshot.
+    """
+    __slots__ = ("states", )
+
+    def __init__(self, states):
+        self.states = states  # (object, attributes to set as they are, attributes to copy with their copy function)
+
+
+def is_immutable(value):
+    return isinstance(value, (bool, int, float, complex, str, bytes, tuple, frozenset, type(None), np.generic))
+
+
+def is_accessor(value):
+    return isinstance(value, (types.FunctionType, functools.partial))
+
+
+def get_copy_function(value, shared):
+    # cheapest copy which leaves the snapshot untouched by a run
+    if isinstance(value, np.ndarray):
+        return np.copy
+    if isinstance(value, (list, set, dict)):
+        items = value.items() if isinstance(value, dict) else zip(value, value)
+        if all(is_immutable(k) and is_immutable(v) for k, v in items):
+            return copy.copy
+    return lambda v: copy.deepcopy(v, dict(shared))
 
 
 class Manager:
-    def __init__(self, config, profile_blueprint, current_account_name, module_blueprints=None):
+    def __init__(self, config, profile_blueprint, current_account_name, module_blueprints=None, runs=None,
+                 seed=None, first_run=0):
         self.config = copy.deepcopy(config)
         self.year = config["simulation"]["start_year"]
+        # None: a single run with plain scalar state, int: a batch of runs with one vector entry per run
+        self.runs = runs
+        self.random = RandomStreams(seed=seed, runs=runs, first_run=first_run,
+                                    antithetic=config["simulation"].get("antithetic", False),
+                                    control_variates=config["simulation"].get("control_variates", False),
+                                    qmc=config["simulation"].get("qmc", False),
+                                    horizon=config["simulation"]["end_year"] - config["simulation"]["start_year"])
+        self.control_columns = dict()  # random stream: result column of its control variate
+        # tilted distributions, e.g. {"event_hazard": 5, "return_shift": -0.5}, see write_likelihood_ratio
+        self.importance_sampling = dict(config["simulation"].get("importance_sampling") or {}) \
+            if config["simulation"]["random"] else dict()
         self.modules = collections.OrderedDict()
+        self.feedback_free_modules = []  # names of the modules computing all years ahead, see precompute
+        # scheduled modules (events) are called only in the years they ask for, see next_year
+        self.event_calendar = collections.defaultdict(list)  # year: names of the events to wake up
+        self.awake_events = dict()  # names of the events called this year, a set in order of waking up
         self.profile = profile_blueprint.build_class(manager=self, **profile_blueprint.build_config)
         self.current_account_name = current_account_name  # TODO is this really needed?
 
         self.df_row = dict(year=self.year)
+        self.schema = ColumnSchema()
+        self.schema.declare("year", dtype=int)
+        if self.importance_sampling:
+            self.schema.declare("likelihood_ratio")
+        self.result_row = None
+        self._profiler = None  # a ModuleProfiler to time the modules
 
         if module_blueprints is not None:
             for module_blueprint in module_blueprints:  # TODO put sorting of dependencies here?!
                 self.add_module(module_blueprint)
+            self.link()
+            for module_blueprint in module_blueprints:
+                self.check_declarations(module_blueprint)
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @profiler.setter
+    def profiler(self, profiler):
+        self._profiler = profiler
+        # the accessors of the modules count their calls while profiled, see Module.count_lookups
+        self.link()
 
     @property
     def current_account(self):
         return self.modules[self.current_account_name]
 
     def add_module(self, module_blueprint):
-        self.modules[module_blueprint.name] = \
-            module_blueprint.build_class(manager=self, run_end_of_year=module_blueprint.run_end_of_year,
-                                         name=module_blueprint.name, **module_blueprint.build_config)
+        module = module_blueprint.build_class(manager=self, run_end_of_year=module_blueprint.run_end_of_year,
+                                              name=module_blueprint.name, **module_blueprint.build_config)
+        module.declare_columns(self.schema)
+        self.modules[module_blueprint.name] = module
+        if module_blueprint.feedback_free:
+            self.feedback_free_modules.append(module_blueprint.name)
+        if module.scheduled:
+            self.event_calendar[self.year + 1].append(module_blueprint.name)
+        module.link()
+
+    def check_declarations(self, module_blueprint):
+        """
+        The modules are sorted by the reads and writes their classes declare (Module.get_reads, Module.get_writes),
+        a module linking other modules than declared would be sorted wrongly and read values of the previous year.
+        """
+        module = self.modules[module_blueprint.name]
+        undeclared_reads = module.depends_on_modules - resolve_current_account(
+            module_blueprint.build_class.get_reads(module_blueprint.build_config), self.current_account_name)
+        assert not undeclared_reads, f"{module.name} reads undeclared modules {sorted(undeclared_reads)}"
+        undeclared_writes = module.modifies_modules - resolve_current_account(
+            module_blueprint.build_class.get_writes(module_blueprint.build_config), self.current_account_name)
+        assert not undeclared_writes, f"{module.name} modifies undeclared modules {sorted(undeclared_writes)}"
+
+    def declare_random_driver(self, stream, normal=True):
+        """
+        A random stream a module draws one number per year from, a dimension of the Sobol points in qmc mode.
+        The control variate of a stream of normal numbers (RandomStreams.get_control) is written as column
+        "control.<stream>", if enabled by control_variates in the simulation config.
+        """
+        self.random.add_driver(stream, distribution="standard_normal" if normal else "random")
+        if normal and self.random.control_variates and self.config["simulation"]["random"]:
+            self.control_columns[stream] = f"control.{stream}"
+            self.schema.declare(self.control_columns[stream])
+
+    def link(self):
+        # modules linked before all others were added look those up on each access
+        for module in self.modules.values():
+            module.link()
+
+    def write_results(self, result, runs):
+        """
+        Write the yearly rows into the preallocated buffers of result instead of a new dict per year.
+        runs: index of the run, or slice of the runs of a batch, within result
+        """
+        assert result.schema == self.schema
+        self.result_row = result.row(runs=runs)
+
+    def snapshot(self):
+        """
+        Capture the state of the built manager, restore resets it before each run instead of building a new manager.
+        """
+        objects = [self, self.profile] + list(self.modules.values())
+        # references to these are kept, the config and the module structure do not change during a run
+        shared = {id(obj): obj for obj in objects + [self.config, self.modules, self.schema, self.random,
+                                                     self.profiler]}
+        states = []
+        for obj in objects:
+            fixed = {k: v for k, v in vars(obj).items() if is_immutable(v) or id(v) in shared or is_accessor(v)}
+            copied = [(k, copy.deepcopy(v, dict(shared)), get_copy_function(v, shared))
+                      for k, v in vars(obj).items() if k not in fixed]
+            states += [(obj, fixed, copied)]
+        return ManagerSnapshot(states=states)
+
+    def restore(self, snapshot, first_run=None):
+        """
+        Reset the manager to the snapshot, with fresh random streams starting at first_run.
+        """
+        if first_run is None:
+            first_run = self.random.first_run
+        for obj, fixed, copied in snapshot.states:
+            state = obj.__dict__
+            state.clear()
+            state.update(fixed)
+            for k, v, copy_function in copied:
+                state[k] = copy_function(v)
+        self.random = self.random.restart(first_run=first_run)
 
     def get_module(self, module_name):
         return self.modules[module_name]
 
+    def precompute(self):
+        """
+        Feedback free modules compute the values of all years at once, only the coupled ones are computed year by year.
+        """
+        years = self.config["simulation"]["end_year"] - self.config["simulation"]["start_year"]
+        for module_name in self.feedback_free_modules:
+            self.modules[module_name].precompute(years=years)
+
+    @property
+    def year_index(self):
+        # index of the current year within the simulated years
+        return self.year - self.config["simulation"]["start_year"] - 1
+
     def next_year(self):
+        if self.year == self.config["simulation"]["start_year"]:
+            self.precompute()
         self.year += 1
-        self.df_row = dict(year=self.year)
-        for module_name, module in self.modules.items():
-            module.next_year_wrapper()
-        if self.profile:
-            self.profile.update()
+        if self.result_row is not None:
+            self.result_row.year_index = self.year_index
+            self.df_row = self.result_row
+            self.df_row["year"] = self.year
+        else:
+            self.df_row = dict(year=self.year) if self.runs is None else BatchRow(year=self.year)
+        modules = self.get_modules_of_year()
+        if self.profiler is not None:
+            for module in modules:
+                self.profiler.next_year(module)
+            if self.profile:
+                self.profiler.update_profile(self.profile)
+        else:
+            for module in modules:
+                module.next_year_wrapper()
+            if self.profile:
+                self.profile.update()
+        self.schedule_events()
+        for stream, column in self.control_columns.items():
+            self.df_row[column] = self.random.get_control(stream)
+        if self.importance_sampling:
+            self.write_likelihood_ratio()
 
-    def dependency_check(self):
-        for module_name, module in self.modules.items():
-            module.dependency_check = True
-            module.next_year_wrapper()
+    def get_modules_of_year(self):
+        """
+        Modules to call this year in their order: all but the scheduled ones (events), which only if woken up for
+        this year. Dormant events cost nothing per year, only the active ones.
+        """
+        for module_name in self.event_calendar.pop(self.year, []):
+            self.awake_events[module_name] = None
+        if not self.awake_events:
+            return [module for module in self.modules.values() if not module.scheduled]
+        return [module for module_name, module in self.modules.items()
+                if not module.scheduled or module_name in self.awake_events]
+
+    def schedule_events(self):
+        # events stay awake while active, the others are filed for the year they start (again), if any
+        for module_name in list(self.awake_events):
+            wakeup_year = self.modules[module_name].get_wakeup_year()
+            if wakeup_year != self.year + 1:
+                del self.awake_events[module_name]
+                if wakeup_year is not None:
+                    self.event_calendar[wakeup_year].append(module_name)
+
+    def write_likelihood_ratio(self):
+        """
+        With importance sampling (simulation: importance_sampling) rare outcomes are sampled more often, events with
+        event_hazard times their probability and the returns of Standard investments with their normal numbers
+        shifted by return_shift standard deviations. Each run carries the likelihood ratio of the original to the
+        sampled distribution up to the year in column "likelihood_ratio", the weight of the run in estimates.
+        """
+        self.df_row["likelihood_ratio"] = np.exp(self.random.log_likelihood_ratio)
 
     @property
     def total_assets(self):
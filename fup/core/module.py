@@ -1,15 +1,33 @@
-import random
-from fup.core.functions import get_full_class_name
+import functools
+
+import numpy as np
+from fup.core.functions import get_full_class_name, register_class, where
+
+CURRENT_ACCOUNT = "current_account"  # the current account of the manager (current_account_name) in reads and writes
+
+
+def resolve_current_account(module_names, current_account_name):
+    # module names of declared reads or writes, the current account by the name of its module
+    return {current_account_name if module_name == CURRENT_ACCOUNT else module_name for module_name in module_names}
 
 
 class Module:
+    scheduled = False  # called by the manager only in the years of get_wakeup_year, see EventModule
+    # properties of other modules next_year reads and modifies, {module name: [properties]}, see get_reads
+    reads = {}
+    writes = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        register_class(cls)
+
     def __init__(self, name="", manager=None, run_end_of_year=False, **kwargs):
         self.name = name
         self.manager = manager
         self.depends_on_modules = set()
         self.modifies_modules = set()
-        self.dependency_check = False
         self.run_end_of_year = run_end_of_year
+        self.run_mask = None  # batch runs the changes of this module apply to, None for all
 
         for k, v in kwargs.items():
             assert isinstance(k, str)
@@ -23,6 +41,11 @@ class Module:
     def df_row(self):
         return self.manager.df_row
 
+    def declare_columns(self, schema):
+        # columns this module writes into the df_row
+        if hasattr(self, "info_name"):
+            schema.declare(self.info_name)
+
     @property
     def info(self):
         return {
@@ -31,28 +54,96 @@ class Module:
             "info": self.get_extra_info()
         }
 
+    @classmethod
+    def get_reads(cls, build_config):
+        """
+        Properties of other modules the module reads, {module name: [properties]}, for its build config (e.g. module
+        names given in the config). The modules are sorted by these declarations, without building them.
+        """
+        return cls.reads
+
+    @classmethod
+    def get_writes(cls, build_config):
+        """
+        Properties of other modules the module modifies, {module name: [properties]}, see get_reads
+        """
+        return cls.writes
+
     def get_prop(self, module_name, prop_name):
-        if self.dependency_check:
-            self.depends_on_modules.add(module_name)
+        if self.manager.profiler is not None:
+            self.manager.profiler.lookups[self.name] += 1
         return getattr(self.manager.get_module(module_name), prop_name)
 
-    def add_prop(self, prop_name, change_value):
+    def add_prop(self, prop_name, change_value, mask=None):
         prop_value = getattr(self, prop_name)
+        if mask is not None:
+            change_value = np.where(mask, change_value, 0)
         setattr(self, prop_name, prop_value+change_value)
 
-    def multiply_prop(self, prop_name, change_value):
+    def multiply_prop(self, prop_name, change_value, mask=None):
         prop_value = getattr(self, prop_name)
+        if mask is not None:
+            change_value = np.where(mask, change_value, 1)
         setattr(self, prop_name, prop_value*change_value)
 
+    def get_linked_module(self, module_name):
+        # the module itself if already added, otherwise a lookup on each access
+        if module_name in self.manager.modules:
+            module = self.manager.modules[module_name]
+            return lambda: module
+        return lambda: self.manager.get_module(module_name)
+
+    def get_prop_getter(self, module_name, prop_name):
+        """
+        Accessor of a property of another module, created once in link instead of get_prop every year.
+        """
+        self.depends_on_modules.add(module_name)
+        if module_name in self.manager.modules:
+            return self.count_lookups(functools.partial(getattr, self.manager.modules[module_name], prop_name))
+        get_module = self.get_linked_module(module_name)
+        return self.count_lookups(lambda: getattr(get_module(), prop_name))
+
     def get_prop_adder(self, module_name, prop_name):
-        if self.dependency_check:
-            self.modifies_modules.add(module_name)
-        return lambda x: self.manager.get_module(module_name).add_prop(prop_name=prop_name, change_value=x)
+        self.modifies_modules.add(module_name)
+        get_module = self.get_linked_module(module_name)
+        return self.count_lookups(
+            lambda x: get_module().add_prop(prop_name=prop_name, change_value=x, mask=self.run_mask))
 
     def get_prop_multiplier(self, module_name, prop_name):
-        if self.dependency_check:
-            self.modifies_modules.add(module_name)
-        return lambda x: self.manager.get_module(module_name).multiply_prop(prop_name=prop_name, change_value=x)
+        self.modifies_modules.add(module_name)
+        get_module = self.get_linked_module(module_name)
+        return self.count_lookups(
+            lambda x: get_module().multiply_prop(prop_name=prop_name, change_value=x, mask=self.run_mask))
+
+    def count_lookups(self, accessor):
+        """
+        The accessor, counting its calls as lookups of this module while the manager is profiled. Without profiler
+        the accessor itself, the manager links the modules again when the profiler is set.
+        """
+        profiler = self.manager.profiler
+        if profiler is None:
+            return accessor
+        lookups, name = profiler.lookups, self.name
+
+        def counted_accessor(*args):
+            lookups[name] += 1
+            return accessor(*args)
+        return counted_accessor
+
+    def link(self):
+        """
+        Resolve the references to other modules into accessors (get_prop_getter, get_prop_adder,
+        get_prop_multiplier) for next_year. Called by the manager when modules are added.
+        """
+        pass
+
+    def precompute(self, years):
+        """
+        Compute the values of all years at once, before the first year. Called by the manager for feedback free
+        modules (BluePrint.feedback_free), whose values do not depend on other modules. next_year then only takes the
+        values of its year.
+        """
+        pass
 
     # wrapper which can be overwritten by submodule class
     def next_year_wrapper(self):
@@ -88,19 +179,26 @@ class AssetModule(Module):
         return out_dict
 
     def change(self, money):
-        if money > 0:
-            add_money_value = money * (1 - self.exchange_fee)
-            self.asset_value = (self.count * self.asset_value + add_money_value) / (self.count + add_money_value)
-            self.count += add_money_value
-            return -money
-        else:
-            asset_count = abs(money) / self.asset_value
-            self.count -= asset_count
-            asset_value_with_fee = self.asset_value * (1 - self.exchange_fee)
-            return_money = asset_value_with_fee * asset_count
-            if asset_value_with_fee > 1:
-                return_money *= 1 - (asset_value_with_fee - 1) / asset_value_with_fee * self.gains_tax
-            return return_money
+        # buy for positive money, sell otherwise; both branches are evaluated to work on batches of runs
+        buy = money > 0
+        add_money_value = where(buy, money, 0) * (1 - self.exchange_fee)
+        asset_count = where(buy, 0, -money) / self.asset_value
+        new_count = self.count + add_money_value
+        buy_asset_value = (self.count * self.asset_value + add_money_value) / where(buy, new_count, 1)
+        self.asset_value = where(buy, buy_asset_value, self.asset_value)
+        self.count = new_count - asset_count
+
+        asset_value_with_fee = self.asset_value * (1 - self.exchange_fee)
+        return_money = asset_value_with_fee * asset_count
+        gains = asset_value_with_fee > 1
+        taxed_return_money = return_money * (1 - (asset_value_with_fee - 1) / where(gains, asset_value_with_fee, 1)
+                                             * self.gains_tax)
+        return_money = where(gains, taxed_return_money, return_money)
+        return where(buy, -money, return_money)
+
+    def declare_columns(self, schema):
+        super().declare_columns(schema)
+        schema.declare("assets")
 
     def change_value(self, relative_change):
         self.asset_value *= relative_change
@@ -114,38 +212,143 @@ class AssetModule(Module):
 
 
 class EventModule(Module):
+    """
+    An event (e.g. a crisis) starting at start_year, or each year with probability while not active.
+    Runs only in the years it is active (next_year ends it by setting active to False) and the year it starts,
+    the manager wakes it up then (get_wakeup_year).
+    """
+    scheduled = True
+    never = np.iinfo(np.int64).max  # next start if the event does not start (again)
+
     def __init__(self, name="", manager=None, start_year=None, probability=None, **kwargs):
         super().__init__(name=name, manager=manager, **kwargs)
         self.start_year = start_year
+        self.fixed_start_year = start_year
         self.probability = probability
-        self.active = False
+        self._active = False
         self.crisis_year = 0
+        self.next_start = None  # year of the next start (per run), drawn in the first year
+
+    @property
+    def active(self):
+        return self._active
+
+    @active.setter
+    def active(self, value):
+        # within a batch only the runs currently handled by next_year are (de)activated
+        if self.run_mask is not None:
+            value = np.where(self.run_mask, value, self._active)
+        self._active = value
+
+    def declare_columns(self, schema):
+        super().declare_columns(schema)
+        schema.declare("event", dtype=object)
+        if self.probability:
+            self.manager.declare_random_driver(self.name, normal=False)
 
     def get_extra_info(self):
         return f"start: {self.start_year}"
 
-    def next_year_wrapper(self):
-        if not self.dependency_check:
-            if self.probability and not self.active:
-                if self.config["simulation"]["random"]:
-                    if random.random() < self.probability:
-                        self.start_year = self.manager.year
-
-            if self.start_year == self.manager.year:
-                self.active = True
+    def get_next_start(self, at_risk, from_year):
+        """
+        Year of the next start of the event from from_year on in the runs at risk (not active): the configured
+        start_year, or the first year of a yearly probability drawn at once from the geometric distribution of the
+        waiting time. never if not within the simulated years.
+        With importance sampling it is drawn with event_hazard times the probability (at most 0.5, unless higher),
+        the likelihood ratio of the runs at risk is corrected for the years up to the start.
+        """
+        end_year = self.config["simulation"]["end_year"]
+        fixed = self.fixed_start_year is not None and self.fixed_start_year >= from_year
+        next_start = self.fixed_start_year if fixed else self.never
+        if not (self.probability and self.config["simulation"]["random"]) or from_year > end_year:
+            return where(at_risk, next_start, self.never)
+
+        last_year = min(end_year, self.fixed_start_year - 1) if fixed else end_year
+        probability = min(self.probability * self.manager.importance_sampling.get("event_hazard", 1),
+                          max(self.probability, 0.5))
+        draw = self.manager.random.uniform_at(self.name, index=from_year - self.config["simulation"]["start_year"] - 1)
+        waiting_years = np.maximum(np.ceil(np.log1p(-draw) / np.log1p(-probability)), 1)
+        drawn_start = (from_year + waiting_years - 1).astype(np.int64)
+        started = at_risk & (drawn_start <= last_year)
+        next_start = where(started, drawn_start, next_start)
+        if probability != self.probability:
+            log_ratio = where(started, np.log(self.probability / probability), 0.) \
+                + where(started, waiting_years - 1, last_year - from_year + 1) \
+                * np.log((1 - self.probability) / (1 - probability))
+            self.manager.random.add_log_likelihood_ratio(where(at_risk, log_ratio, 0.))
+        return where(at_risk, next_start, self.never)
+
+    def get_wakeup_year(self):
+        # next year the manager has to call the module, None if never again
+        if np.any(self._active):
+            return self.manager.year + 1
+        next_start = int(np.min(self.next_start))
+        return None if next_start == self.never else next_start
 
-            if not self.active:
-                return
-
-            self.crisis_year = self.manager.year - self.start_year
-
-        self.next_year()
+    def next_year_wrapper(self):
+        """
+        Called by the manager only in the years the event is active or starts, see Manager.next_year.
+        """
+        if self.manager.runs is not None:
+            self.next_year_batch()
+            return
+
+        year = self.manager.year
+        if self.next_start is None:
+            self.next_start = self.get_next_start(at_risk=not self.active, from_year=year)
+        if not self.active and self.next_start == year:
+            self.start_year = year
+            self.active = True
 
         if self.active:
-            if "event" in self.df_row:
-                self.df_row["event"] += "," + self.name
+            self.crisis_year = year - self.start_year
+            self.next_year()
+            if self.active:
+                if "event" in self.df_row:
+                    self.df_row["event"] += "," + self.name
+                else:
+                    self.df_row["event"] = self.name
             else:
-                self.df_row["event"] = self.name
+                self.next_start = self.get_next_start(at_risk=True, from_year=year + 1)
+
+    def next_year_batch(self):
+        runs = self.manager.runs
+        year = self.manager.year
+        if self.next_start is None:
+            # start years differ between runs as soon as they are drawn
+            start_year = -1 if self.start_year is None else self.start_year
+            self.start_year = np.full(runs, start_year)
+            self._active = np.full(runs, bool(self._active))
+            self.next_start = self.get_next_start(at_risk=~self._active, from_year=year)
+
+        started = ~self._active & (self.next_start == year)
+        self.start_year = np.where(started, year, self.start_year)
+        self._active = self._active | started
+        if not self._active.any():
+            return
+
+        was_active = self._active
+        self.next_year_runs(crisis_years=year - self.start_year)
+
+        ended = was_active & ~self._active
+        if ended.any():
+            self.next_start = np.where(ended, self.get_next_start(at_risk=ended, from_year=year + 1), self.next_start)
+        if self._active.any():
+            event = self.df_row.get("event", np.full(runs, None, dtype=object))
+            has_event = event != None  # noqa: E711
+            named = np.where(has_event, event, "") + np.where(has_event, ",", "") + self.name
+            self.df_row["event"] = np.where(self._active, named, event)
+
+    def next_year_runs(self, crisis_years):
+        """
+        next_year of the active runs of a batch, crisis_years: year of the event in each run.
+        Runs in the same year of the event share one call of next_year.
+        """
+        for crisis_year in np.unique(crisis_years[self._active]):
+            self.run_mask = self._active & (crisis_years == crisis_year)
+            self.crisis_year = int(crisis_year)
+            self.next_year()
+        self.run_mask = None
 
     def __repr__(self):
         return f"{get_full_class_name(self.__class__)}: active: {int(self.active)} start: {self.start_year}" \
@@ -183,6 +386,11 @@ class ChangeModule(Module):
         out_dict["expenses"] = self.expenses
         return out_dict
 
+    def declare_columns(self, schema):
+        super().declare_columns(schema)
+        schema.declare("income")
+        schema.declare("expenses")
+
     def next_year_wrapper(self):
         self.income = 0
         self.expenses = 0
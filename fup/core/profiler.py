@@ -0,0 +1,67 @@
+import collections
+import time
+
+import pandas as pd
+
+from fup.core.functions import get_full_class_name
+
+
+class ModuleProfiler:
+    """
+    Wall time and number of calls of next_year per module, and its lookups of other modules, by name (get_prop) or
+    through the linked accessors (Module.get_prop_getter, get_prop_adder, get_prop_multiplier).
+    Opt-in by setting Manager.profiler, e.g. by run_simulations(profiler=ModuleProfiler()), which adds up all runs.
+    """
+    profile_name = "profile"  # the update of the profile after the modules
+
+    def __init__(self):
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.lookups = collections.defaultdict(int)
+        self.classes = dict()
+
+    def next_year(self, module):
+        time_start = time.perf_counter()
+        module.next_year_wrapper()
+        self.seconds[module.name] += time.perf_counter() - time_start
+        self.calls[module.name] += 1
+        if module.name not in self.classes:
+            self.classes[module.name] = get_full_class_name(module.__class__)
+
+    def update_profile(self, profile):
+        time_start = time.perf_counter()
+        profile.update()
+        self.seconds[self.profile_name] += time.perf_counter() - time_start
+        self.calls[self.profile_name] += 1
+        self.classes[self.profile_name] = get_full_class_name(profile.__class__)
+
+    def merge(self, other):
+        for name in other.calls:
+            self.seconds[name] += other.seconds[name]
+            self.calls[name] += other.calls[name]
+            self.classes[name] = other.classes[name]
+        for name, lookups in other.lookups.items():
+            self.lookups[name] += lookups
+
+    def to_dataframe(self):
+        """
+        One row per module, the slowest first.
+        """
+        total = sum(self.seconds.values())
+        df = pd.DataFrame([dict(module=name,
+                                 **{"class": self.classes[name]},
+                                 calls=self.calls[name],
+                                 seconds=self.seconds[name],
+                                 ms_per_call=self.seconds[name] / self.calls[name] * 1e3,
+                                 share=self.seconds[name] / total if total > 0 else 0.,
+                                 lookups=self.lookups.get(name, 0))
+                            for name in self.calls],
+                          columns=["module", "class", "calls", "seconds", "ms_per_call", "share", "lookups"])
+        return df.sort_values("seconds", ascending=False, ignore_index=True)
+
+    def to_collapsed_stacks(self):
+        """
+        Collapsed stack text (one "frame;frame microseconds" line per module) for flamegraph tools.
+        """
+        return "\n".join(f"Manager.next_year;{self.classes[name]}:{name} {int(round(self.seconds[name] * 1e6))}"
+                         for name in self.calls) + "\n"
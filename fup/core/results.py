@@ -0,0 +1,181 @@
+import collections
+
+import numpy as np
+import pandas as pd
+
+
+class ColumnSchema:
+    """
+    Columns of the simulation results, declared by the modules when they are added to a manager.
+    Numeric columns are stored as float, object columns (like the names of active events) as python objects.
+    """
+
+    def __init__(self):
+        self.columns = collections.OrderedDict()
+        self.numeric_columns = []
+        self.object_columns = []
+
+    def declare(self, name, dtype=float):
+        if name in self.columns:
+            return
+        if dtype is object:
+            self.columns[name] = (dtype, len(self.object_columns))
+            self.object_columns += [name]
+        else:
+            self.columns[name] = (dtype, len(self.numeric_columns))
+            self.numeric_columns += [name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __eq__(self, other):
+        return isinstance(other, ColumnSchema) and list(self.columns.items()) == list(other.columns.items())
+
+
+class ResultRow:
+    """
+    The df_row of a manager writing into a SimulationResult: the current year of one run or a slice of runs.
+    """
+
+    def __init__(self, result, runs):
+        self.result = result
+        self.runs = runs
+        self.batch = not isinstance(runs, (int, np.integer))
+        self._numeric = dict()
+        self._object = dict()
+        for column, (dtype, index) in result.schema.columns.items():
+            if dtype is object:
+                self._object[column] = index
+            else:
+                self._numeric[column] = index
+        self.year_index = 0
+
+    @property
+    def year_index(self):
+        return self._year_index
+
+    @year_index.setter
+    def year_index(self, year_index):
+        # views on the buffers of the current year, shape (columns,) for a run or (runs, columns) for a batch
+        self._year_index = year_index
+        self._values = self.result.values[self.runs, year_index]
+        self._objects = self.result.objects[self.runs, year_index]
+
+    def _locate(self, column):
+        if column in self._numeric:
+            return self._values, self._numeric[column]
+        if column in self._object:
+            return self._objects, self._object[column]
+        raise KeyError(f"Column {column} is not declared by any module")
+
+    def __setitem__(self, column, value):
+        values, index = self._locate(column)
+        if self.batch:
+            values[:, index] = value
+        else:
+            values[index] = value
+
+    def __getitem__(self, column):
+        values, index = self._locate(column)
+        if self.batch:
+            return values[:, index]
+        return values[index]
+
+    def __contains__(self, column):
+        if column in self._numeric:
+            return True
+        if column in self._object:
+            return np.any(self[column] != None)  # noqa: E711
+        return False
+
+    def get(self, column, default=None):
+        if column not in self:
+            return default
+        return self[column]
+
+
+class SimulationResult:
+    """
+    Preallocated runs x years x columns buffers the managers write their yearly rows into.
+    The derived columns are computed once over the whole buffer, a pandas DataFrame is only built on request.
+    """
+    derived_columns = ["expenses_net", "income_net", "expenses_net_cor", "income_net_cor", "assets_cor"]
+
+    def __init__(self, schema, runs, years, first_run=0, values=None, objects=None):
+        self.schema = schema
+        self.runs = runs
+        self.n_years = years
+        self.first_run = first_run
+        self.values = np.zeros((runs, years, len(schema.numeric_columns))) if values is None else values
+        self.objects = np.full((runs, years, len(schema.object_columns)), None, dtype=object) \
+            if objects is None else objects
+        self._derived = None
+        self.profiler = None  # ModuleProfiler of the simulation of the runs, if profiled
+
+    def row(self, runs):
+        return ResultRow(result=self, runs=runs)
+
+    @classmethod
+    def concat(cls, results):
+        if len(results) == 1:
+            return results[0]
+        assert all(result.schema == results[0].schema for result in results)
+        return cls(schema=results[0].schema,
+                   runs=sum(result.runs for result in results),
+                   years=results[0].n_years,
+                   first_run=results[0].first_run,
+                   values=np.concatenate([result.values for result in results]),
+                   objects=np.concatenate([result.objects for result in results]))
+
+    @property
+    def run_numbers(self):
+        return np.arange(self.first_run, self.first_run + self.runs)
+
+    @property
+    def years(self):
+        return self["year"][0].astype(int)
+
+    @property
+    def columns(self):
+        return list(self.schema.columns) + list(self.derived)
+
+    @property
+    def derived(self):
+        if self._derived is None:
+            self._derived = dict()
+            required = ["expenses", "income", "tax", "tax_offset", "total_inflation", "assets"]
+            if all(column in self.schema for column in required):
+                tax = self["tax"] + self["tax_offset"]
+                total_inflation = self["total_inflation"]
+                # tax correction
+                self._derived["expenses_net"] = self["expenses"] - tax
+                self._derived["income_net"] = self["income"] - tax
+                # Inflation corrected
+                self._derived["expenses_net_cor"] = self._derived["expenses_net"] / total_inflation
+                self._derived["income_net_cor"] = self._derived["income_net"] / total_inflation
+                self._derived["assets_cor"] = self["assets"] / total_inflation
+        return self._derived
+
+    def __getitem__(self, column):
+        """
+        Values of a column as (runs, years) array.
+        """
+        if column in self.schema:
+            dtype, index = self.schema.columns[column]
+            if dtype is object:
+                return self.objects[:, :, index]
+            return self.values[:, :, index]
+        return self.derived[column]
+
+    def to_dataframe(self):
+        data = dict()
+        for column, (dtype, index) in self.schema.columns.items():
+            if dtype is object:
+                values = self.objects[:, :, index].ravel()
+                data[column] = np.where(values == None, np.nan, values)  # noqa: E711
+            else:
+                data[column] = self.values[:, :, index].ravel().astype(dtype)
+        data["run"] = np.repeat(self.run_numbers, self.n_years)
+        for column, values in self.derived.items():
+            data[column] = values.ravel()
+        return pd.DataFrame(data, index=np.tile(np.arange(self.n_years), self.runs))
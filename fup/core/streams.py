@@ -0,0 +1,317 @@
+import json
+import os
+import warnings
+import zlib
+
+import numpy as np
+
+
+class RandomStreams:
+    """
+    Random numbers of a simulation, drawn from one independent numpy generator per run and stream.
+
+    Each generator is seeded by (seed, run, stream), thus every run can be repeated on its own and
+    a stream (one per module) is not shifted if other modules draw more or fewer numbers.
+    The same seed gives the same random numbers in every scenario (common random numbers).
+    Numbers are drawn in blocks, a batch of runs gets one number per run with each call.
+
+    antithetic: the normal numbers of each odd run are the negated ones of the run before (pairs 0/1, 2/3, ...),
+    other distributions stay independent.
+    control_variates: keep the sum of the standard normal numbers per stream and run, see get_control.
+    qmc: the yearly numbers of the driver streams (add_driver) over the horizon (number of years) are one point of a
+    scrambled Sobol sequence per run instead, see get_qmc_shocks. Requires scipy.
+    tape: a DriverTape, the numbers of its streams are replayed instead of drawn.
+    log_likelihood_ratio: log of the likelihood ratio of the original to the sampled distribution of the numbers
+    drawn so far per run, changed by tilted draws (normal with shift, add_log_likelihood_ratio) for importance sampling.
+    """
+    mirrored = {"standard_normal": np.negative}  # antithetic counterpart of the numbers of a distribution
+
+    def __init__(self, seed=None, runs=None, first_run=0, block_size=256, antithetic=False, control_variates=False,
+                 qmc=False, horizon=None, drivers=None, tape=None):
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.runs = runs
+        self.first_run = first_run
+        self.block_size = block_size
+        self.antithetic = antithetic
+        self.control_variates = control_variates
+        self.qmc = qmc
+        self.horizon = horizon
+        self.drivers = dict(drivers or {})  # stream: distribution
+        self.tape = None
+        self._blocks = dict()
+        self._normal_sums = dict()  # stream: [sum of the standard normal numbers, number of draws]
+        self._qmc_shocks = None  # stream: (years, runs) standard normal shocks
+        self.log_likelihood_ratio = 0.
+        self._positions = dict()  # (stream, distribution): number of numbers drawn from the qmc points or the tape
+        self._sequences = dict()  # (stream, distribution): generators and all blocks drawn, for draw_at
+        if tape is not None:
+            self.use_tape(tape)
+
+    def restart(self, first_run):
+        """
+        Fresh streams with the same settings starting at first_run.
+        """
+        return RandomStreams(seed=self.seed, runs=self.runs, first_run=first_run, block_size=self.block_size,
+                             antithetic=self.antithetic, control_variates=self.control_variates, qmc=self.qmc,
+                             horizon=self.horizon, drivers=self.drivers, tape=self.tape)
+
+    @property
+    def settings(self):
+        # everything the numbers of the driver streams depend on
+        return dict(seed=self.seed, antithetic=self.antithetic, qmc=self.qmc, horizon=self.horizon)
+
+    def add_driver(self, stream, distribution="standard_normal"):
+        """
+        A stream with one number per year, taken from the Sobol points in qmc mode and recorded by DriverTape.
+        """
+        assert self._qmc_shocks is None, "drivers are added before the first number is drawn"
+        self.drivers[stream] = distribution
+
+    def use_tape(self, tape):
+        if tape.settings != self.settings:
+            raise ValueError(f"the driver tape was recorded with {tape.settings}, not {self.settings}")
+        self.tape = tape
+
+    @property
+    def run_numbers(self):
+        return range(self.first_run, self.first_run + (1 if self.runs is None else self.runs))
+
+    def get_generators(self, stream, distribution):
+        stream_key = (zlib.crc32(stream.encode()), zlib.crc32(distribution.encode()))
+        pairs = self.antithetic and distribution in self.mirrored
+        return [np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(run - run % 2 if pairs else run,)
+                                                                                  + stream_key))
+                for run in self.run_numbers]
+
+    def get_qmc_shocks(self):
+        """
+        Standard normal shocks of each driver stream and year, one scrambled Sobol point of all of them per run.
+
+        The yearly shocks of a stream are the increments of a Brownian path built by a Brownian bridge (end point
+        first, then the midpoints), the dimensions of the points are ordered by bridge level over all streams.
+        Thus the first dimensions, where the Sobol points are most uniform, decide the largest part of the variance.
+        Runs are the points with the run numbers as index, the balance properties hold for 2**m runs from run 0.
+        """
+        try:
+            from scipy.special import ndtri
+            from scipy.stats import qmc
+        except ImportError:  # optional dependency
+            raise ImportError("simulation: qmc requires scipy, e.g. pip install FuturePlanner[qmc]")
+        streams = sorted(self.drivers)  # the same dimensions in every process, independent of the module order
+        order = get_brownian_bridge_order(self.horizon)
+        rng = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(zlib.crc32(b"qmc"),)))
+        try:
+            sobol = qmc.Sobol(d=len(order) * len(streams), scramble=True, rng=rng)
+        except TypeError:  # scipy < 1.15
+            sobol = qmc.Sobol(d=len(order) * len(streams), scramble=True, seed=rng)
+        if self.first_run > 0:
+            sobol.fast_forward(self.first_run)
+        n_runs = 1 if self.runs is None else self.runs
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)  # runs not a power of 2
+            points = sobol.random(n_runs)
+        normals = ndtri(np.clip(points, 1e-12, 1 - 1e-12)).T.reshape(len(order), len(streams), n_runs)
+
+        shocks = dict()
+        for i_stream, stream in enumerate(streams):
+            path = np.zeros((self.horizon + 1, n_runs))
+            for (year, left, right), normal in zip(order, normals[:, i_stream]):
+                if left is None:
+                    path[year] = np.sqrt(year) * normal
+                else:
+                    path[year] = ((right - year) * path[left] + (year - left) * path[right]) / (right - left) \
+                                 + np.sqrt((year - left) * (right - year) / (right - left)) * normal
+            shocks[stream] = np.diff(path, axis=0)
+        return shocks
+
+    def get_qmc_values(self, stream, distribution, index):
+        if self._qmc_shocks is None:
+            self._qmc_shocks = self.get_qmc_shocks()
+        if index >= self.horizon:
+            raise ValueError(f"{stream} draws more than one number per year in qmc mode")
+        value = self._qmc_shocks[stream][index]
+        if distribution == "random":
+            from scipy.special import ndtr
+            return ndtr(value)
+        if distribution != "standard_normal":
+            raise ValueError(f"{distribution} numbers are not supported in qmc mode")
+        return value
+
+    def get_block(self, generators, distribution):
+        block = np.stack([getattr(generator, distribution)(self.block_size) for generator in generators], axis=1)
+        if self.antithetic and distribution in self.mirrored:
+            odd = np.array(self.run_numbers) % 2 == 1
+            block[:, odd] = self.mirrored[distribution](block[:, odd])
+        return block
+
+    def draw(self, stream, distribution):
+        key = (stream, distribution)
+        if (self.tape is not None and key in self.tape.arrays) or (self.qmc and stream in self.drivers):
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            return self.draw_at(stream, distribution, position)
+        if key not in self._blocks:
+            self._blocks[key] = [self.get_generators(stream, distribution), None, self.block_size]
+        entry = self._blocks[key]
+        generators, block, position = entry
+        if position >= self.block_size:
+            block = self.get_block(generators, distribution)
+            position = 0
+            entry[1] = block
+        entry[2] = position + 1
+
+        if self.runs is None:
+            return block[position, 0].item()
+        return block[position]
+
+    def draw_at(self, stream, distribution, index):
+        """
+        The index-th number of a stream (the number draw returns after index others), e.g. the number of a year
+        for a stream drawn only in some years, independent of the numbers drawn before.
+        """
+        key = (stream, distribution)
+        if self.tape is not None and key in self.tape.arrays:
+            values = self.tape.get(key, index, self.first_run, 1 if self.runs is None else self.runs)
+        elif self.qmc and stream in self.drivers:
+            values = self.get_qmc_values(stream, distribution, index)
+        else:
+            if key not in self._sequences:
+                self._sequences[key] = [self.get_generators(stream, distribution), []]
+            generators, blocks = self._sequences[key]
+            while len(blocks) * self.block_size <= index:
+                blocks += [self.get_block(generators, distribution)]
+            values = blocks[index // self.block_size][index % self.block_size]
+        if self.runs is None:
+            return values[0].item()
+        return values
+
+    def add_log_likelihood_ratio(self, log_ratio):
+        self.log_likelihood_ratio = self.log_likelihood_ratio + log_ratio
+
+    def normal(self, stream, mu=0., sigma=1., shift=0.):
+        """
+        shift: mean of the standard normal numbers to sample from (importance sampling), the likelihood ratio to the
+        standard normal distribution is added to log_likelihood_ratio.
+        """
+        value = self.draw(stream, "standard_normal")
+        if shift:
+            value = value + shift
+        self.account_normal(stream, value, shift=shift)
+        return mu + sigma * value
+
+    def normal_path(self, stream, years, shift=0.):
+        """
+        The standard normal numbers (plus shift) of the next years calls of normal at once, (years, runs) array or
+        (years,) for a single run, for modules computing all years ahead. The calls of each year are replaced by
+        account_normal of the number of the year.
+        """
+        return np.array([self.draw_at(stream, "standard_normal", index) for index in range(years)]) + shift
+
+    def account_normal(self, stream, value, shift=0.):
+        # likelihood ratio and control sums of a standard normal number drawn with shift
+        if shift:
+            self.add_log_likelihood_ratio(shift ** 2 / 2 - shift * value)
+        if self.control_variates:
+            entry = self._normal_sums.setdefault(stream, [0., 0])
+            entry[0] = entry[0] + value
+            entry[1] += 1
+
+    def get_control(self, stream):
+        """
+        Standardized sum of the normal numbers of a stream so far: standard normal per run, with expectation 0 however
+        the numbers are used, thus a control variate for the results.
+        """
+        total, count = self._normal_sums.get(stream, (0., 0))
+        return total / np.sqrt(max(count, 1))
+
+    def uniform(self, stream):
+        return self.draw(stream, "random")
+
+    def uniform_at(self, stream, index):
+        return self.draw_at(stream, "random", index)
+
+
+class DriverTape:
+    """
+    The numbers of the driver streams (RandomStreams.add_driver) of the runs 0, ..., runs - 1 over the horizon,
+    drawn once and replayed by RandomStreams(tape=...) instead of drawing them again. The drivers (inflation,
+    investment returns, job, events) do not depend on the other config values, thus all scenarios of a sweep can
+    share one tape, with exactly the numbers they would draw themselves.
+    Kept in memory, or with path as memory-mapped .npy files (one per stream) that are not copied to worker processes.
+    """
+    manifest_name = "tape.json"
+
+    def __init__(self, settings, runs, arrays, path=None):
+        self.settings = settings
+        self.runs = runs
+        self.arrays = arrays  # (stream, distribution): (horizon, runs) array
+        self.path = path
+
+    @classmethod
+    def record(cls, streams, runs, path=None, chunk_size=10000):
+        """
+        Draw the numbers of the drivers of streams (a RandomStreams) for runs runs, chunk by chunk.
+        """
+        settings = streams.settings
+        arrays = dict()
+        files = []
+        for i, (stream, distribution) in enumerate(sorted(streams.drivers.items())):
+            if path is None:
+                arrays[(stream, distribution)] = np.empty((streams.horizon, runs))
+            else:
+                os.makedirs(path, exist_ok=True)
+                files += [[stream, distribution, f"driver_{i}.npy"]]
+                arrays[(stream, distribution)] = np.lib.format.open_memmap(
+                    os.path.join(path, files[-1][2]), mode="w+", shape=(streams.horizon, runs))
+        for first_run in range(0, runs, chunk_size):
+            chunk = RandomStreams(runs=min(chunk_size, runs - first_run), first_run=first_run,
+                                  drivers=streams.drivers, **settings)
+            for (stream, distribution), array in arrays.items():
+                for year in range(streams.horizon):
+                    array[year, first_run:first_run + chunk.runs] = chunk.draw(stream, distribution)
+        if path is None:
+            return cls(settings=settings, runs=runs, arrays=arrays)
+        for array in arrays.values():
+            array.flush()
+        with open(os.path.join(path, cls.manifest_name), "w") as f:
+            json.dump(dict(settings=settings, runs=runs, files=files), f)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, cls.manifest_name)) as f:
+            manifest = json.load(f)
+        arrays = {(stream, distribution): np.load(os.path.join(path, file_name), mmap_mode="r")
+                  for stream, distribution, file_name in manifest["files"]}
+        return cls(settings=manifest["settings"], runs=manifest["runs"], arrays=arrays, path=path)
+
+    def __getstate__(self):
+        # memory-mapped tapes are opened again by the worker processes
+        return dict(path=self.path) if self.path is not None else self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(DriverTape.load(state["path"]).__dict__ if "arrays" not in state else state)
+
+    def get(self, key, position, first_run, runs):
+        if position >= self.settings["horizon"] or first_run + runs > self.runs:
+            raise ValueError(f"{key} of runs {first_run}..{first_run + runs - 1} and draw {position} are not on the "
+                             f"tape of {self.runs} runs and {self.settings['horizon']} draws")
+        return np.array(self.arrays[key][position, first_run:first_run + runs])
+
+
+def get_brownian_bridge_order(years):
+    """
+    Construction order of a Brownian path at the years 1..years: (year, left, right) with the known points left and
+    right it is interpolated between, (years, None, None) for the end point. Level by level, the midpoints first.
+    """
+    order = [(years, None, None)]
+    intervals = [(0, years)]
+    while intervals:
+        next_intervals = []
+        for left, right in intervals:
+            if right - left > 1:
+                middle = (left + right) // 2
+                order += [(middle, left, right)]
+                next_intervals += [(left, middle), (middle, right)]
+        intervals = next_intervals
+    return order
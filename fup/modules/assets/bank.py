@@ -1,4 +1,4 @@
-from fup.core.functions import get_full_class_name
+from fup.core.functions import get_full_class_name, where
 from fup.core.module import Module
 
 
@@ -22,6 +22,11 @@ class CurrentAccount(Module):
         out_dict["value"] = self.money_value
         return out_dict
 
+    def declare_columns(self, schema):
+        super().declare_columns(schema)
+        schema.declare("money")
+        schema.declare("assets")
+
     def change(self, money):
         self.money_value += money
         return -money
@@ -34,9 +39,8 @@ class CurrentAccount(Module):
         return f"""{get_full_class_name(self.__class__)}: {int(self.money_value)}€"""
 
     def next_year(self):
-        if self.money_value > self.penalty_interest_limit:
-            self.money_value -= (self.money_value - self.penalty_interest_limit) * self.penalty_interest_rate
-        if self.money_value < 0:
-            self.money_value += self.money_value * self.overdraft_rate
+        self.money_value -= where(self.money_value > self.penalty_interest_limit,
+                                  (self.money_value - self.penalty_interest_limit) * self.penalty_interest_rate, 0)
+        self.money_value += where(self.money_value < 0, self.money_value * self.overdraft_rate, 0)
 
         self.df_row["money"] = self.money_value
@@ -1,11 +1,39 @@
-import random
+import numpy as np
 from fup.core.module import AssetModule
 
 
 class Standard(AssetModule):
-    def next_year(self):
+    def __init__(self, name="", manager=None, **kwargs):
+        super().__init__(name=name, manager=manager, **kwargs)
+        self.value_increases = None  # return factors and normal numbers of all years, if precomputed
+        self.normals = None
+
+    def declare_columns(self, schema):
+        super().declare_columns(schema)
+        self.manager.declare_random_driver(self.name)
+
+    def get_shift(self):
+        # importance sampling of the left tail: return_shift of the sum of the normal numbers over the horizon
+        shift = self.manager.importance_sampling.get("return_shift", 0.)
+        return shift / np.sqrt(self.manager.random.horizon) if shift else 0.
+
+    def precompute(self, years):
+        # the return factors do not depend on other modules, the depot costs do
         if self.config["simulation"]["random"]:
-            self.asset_value *= 1 + random.gauss(mu=self.value_increase_mean, sigma=self.value_increase_std)
+            self.normals = self.manager.random.normal_path(self.name, years, shift=self.get_shift())
+            self.value_increases = 1 + (self.value_increase_mean + self.value_increase_std * self.normals)
+        else:
+            self.value_increases = np.full(years, 1 + self.value_increase_mean)
+
+    def next_year(self):
+        if self.value_increases is not None:
+            year_index = self.manager.year_index
+            self.asset_value *= self.value_increases[year_index]
+            if self.normals is not None:
+                self.manager.random.account_normal(self.name, self.normals[year_index], shift=self.get_shift())
+        elif self.config["simulation"]["random"]:
+            self.asset_value *= 1 + self.manager.random.normal(
+                self.name, mu=self.value_increase_mean, sigma=self.value_increase_std, shift=self.get_shift())
         else:
             self.asset_value *= 1 + self.value_increase_mean
         self.change(money=-self.money_value * self.depot_costs)
@@ -1,7 +1,147 @@
+import functools
+import os
+
+import numpy as np
+from ruamel.yaml import YAML
+
 from fup.core.module import EventModule
 
+historic_crises_path = os.path.join(os.path.dirname(__file__), "crisis_tables.yaml")
+
+
+class CrisisTable:
+    """
+    Effects of a crisis by crisis year: multipliers of properties of other modules, (module, property) targets.
+    rows: {crisis year or range "first-last": {module: {property: multiplier}}}, see crisis_tables.yaml.
+    A multiplier is a number, a fraction [numerator, denominator], or a reference "module.property" to the value of
+    a property of another module (as multiplier, numerator or denominator), read in the year it is applied.
+    The crisis ends in the last year of the table, after the effects of that year.
+    """
+
+    def __init__(self, rows):
+        years = {}
+        for key, effects in rows.items():
+            first, _, last = str(key).partition("-")
+            for year in range(int(first), int(last or first) + 1):
+                years[year] = effects or {}
+        self.end_year = max(years)
+        self.targets = sorted({(module_name, prop_name) for effects in years.values()
+                               for module_name, props in effects.items() for prop_name in props})
+        # one row per crisis year and a last neutral row, for the runs without the crisis
+        shape = (self.end_year + 2, len(self.targets))
+        self.numerators = np.ones(shape)
+        self.denominators = np.ones(shape)
+        self.has_effect = np.zeros(shape, dtype=bool)
+        self.references = []  # (crisis year, target index, numerator reference, denominator reference)
+        for year, effects in years.items():
+            for module_name, props in effects.items():
+                for prop_name, multiplier in props.items():
+                    target = self.targets.index((module_name, prop_name))
+                    numerator, denominator = multiplier if isinstance(multiplier, list) else (multiplier, 1)
+                    references = [None, None]
+                    for i, value in enumerate((numerator, denominator)):
+                        if isinstance(value, str):
+                            references[i] = tuple(value.rsplit(".", 1))
+                        else:
+                            (self.numerators, self.denominators)[i][year, target] = value
+                    self.has_effect[year, target] = True
+                    if references != [None, None]:
+                        self.references += [(year, target, *references)]
+
+    def __deepcopy__(self, memo):
+        # read only, shared by all copies of the modules (Manager.snapshot)
+        return self
+
+
+@functools.lru_cache()
+def load_crisis_tables(path=historic_crises_path):
+    """
+    Crisis tables of a YAML file by name, by default the tables of the historic crises of this module
+    """
+    with open(path) as f:
+        return {name: CrisisTable(rows) for name, rows in YAML(typ="safe").load(f).items()}
+
+
+class TableCrisis(EventModule):
+    """
+    A crisis applying the multipliers of a CrisisTable, a whole row each year.
+    In a batch the rows of all active runs, in whatever year of the crisis, are gathered at once.
+    table: name of a table in the YAML file tables_path (default: the historic crises), or the rows of a table
+
+    my_crisis:
+      class: events.crisis.TableCrisis
+      probability: 0.02
+      table:
+        0: {assets.stocks.Stocks: {asset_value: 0.6}, main.work.Job: {prob_lose_job: 2}}
+        1-2: {assets.stocks.Stocks: {asset_value: 1.1}}
+        3: {main.work.Job: {prob_lose_job: 0.5}}
+    """
+    table = None
+
+    def __init__(self, name="", manager=None, table=None, tables_path=historic_crises_path, **kwargs):
+        super().__init__(name=name, manager=manager, **kwargs)
+        self.table = self.get_table(table=table, tables_path=tables_path)
+
+    @classmethod
+    def get_table(cls, table=None, tables_path=historic_crises_path):
+        table = cls.table if table is None else table
+        return CrisisTable(table) if isinstance(table, dict) else load_crisis_tables(tables_path)[table]
+
+    @classmethod
+    def get_writes(cls, build_config):
+        table = cls.get_table(table=build_config.get("table"),
+                              tables_path=build_config.get("tables_path", historic_crises_path))
+        writes = dict()
+        for module_name, prop_name in table.targets:
+            writes.setdefault(module_name, []).append(prop_name)
+        return writes
+
+    def link(self):
+        self.multipliers = [self.get_prop_multiplier(module_name, prop_name)
+                            for module_name, prop_name in self.table.targets]
+        self.reference_getters = {(module_name, prop_name): self.get_reference_getter(module_name, prop_name)
+                                  for _, _, *references in self.table.references
+                                  for module_name, prop_name in filter(None, references)}
+
+    def get_reference_getter(self, module_name, prop_name):
+        # plain lookup, no dependency: the crisis usually modifies the module it reads from
+        get_module = self.get_linked_module(module_name)
+        return lambda: getattr(get_module(), prop_name)
+
+    def get_reference(self, reference):
+        return 1 if reference is None else self.reference_getters[reference]()
+
+    def next_year(self):
+        table = self.table
+        year = self.crisis_year
+        numerators = table.numerators[year].tolist()
+        denominators = table.denominators[year].tolist()
+        for reference_year, target, numerator, denominator in table.references:
+            if reference_year == year:
+                numerators[target] *= self.get_reference(numerator)
+                denominators[target] *= self.get_reference(denominator)
+        for target in np.flatnonzero(table.has_effect[year]):
+            self.multipliers[target](numerators[target] / denominators[target])
+        if year >= table.end_year:
+            self.active = False
 
-class OilCrisis1973(EventModule):
+    def next_year_runs(self, crisis_years):
+        table = self.table
+        active = self._active
+        rows = np.where(active, crisis_years, -1)  # the neutral row for inactive runs
+        numerators = table.numerators[rows]
+        denominators = table.denominators[rows]
+        for reference_year, target, numerator, denominator in table.references:
+            in_year = rows == reference_year
+            if in_year.any():
+                numerators[:, target] *= np.where(in_year, self.get_reference(numerator), 1)
+                denominators[:, target] *= np.where(in_year, self.get_reference(denominator), 1)
+        for target in np.flatnonzero(table.has_effect[rows].any(axis=0)):
+            self.multipliers[target](numerators[:, target] / denominators[:, target])
+        self._active = active & (crisis_years < table.end_year)
+
+
+class OilCrisis1973(TableCrisis):
     """
     https://en.wikipedia.org/wiki/1973_oil_crisis
     Stagflation
@@ -15,34 +155,10 @@ class OilCrisis1973(EventModule):
     >> Gold was legalised 1973 in USA!
     """
 
-    def next_year(self):
-        multiply_prob_lose_job = self.get_prop_multiplier("main.work.Job", "prob_lose_job")
-        multiply_prob_find_job = self.get_prop_multiplier("main.work.Job", "prob_find_job")
-        multiply_mean_inflation = self.get_prop_multiplier("main.environment.Inflation", "inflation_mean")
-        multiply_gold_value = self.get_prop_multiplier("assets.resources.Gold", "asset_value")
-        multiply_stocks_value = self.get_prop_multiplier("assets.stocks.Stocks", "asset_value")
-
-        if self.crisis_year == 0:
-            multiply_prob_lose_job(2)
-            multiply_prob_find_job(0.5)
-            multiply_mean_inflation(1.087 / 1.022) #
-        elif self.crisis_year == 1:
-            multiply_mean_inflation(1.123 / 1.087) #
-            multiply_gold_value(770. / 400.)
-            multiply_stocks_value(3181 / 6300)
-        elif self.crisis_year == 2:
-            multiply_mean_inflation(1.069 / 1.123) #
-            multiply_gold_value(660. / 770.)
-            multiply_stocks_value(4100. / 3181.)
-        elif self.crisis_year == 3:
-            multiply_prob_lose_job(0.5)
-            multiply_prob_find_job(2)
-            multiply_mean_inflation(1.022 / 1.069) #
-        else:
-            self.active = False
+    table = "OilCrisis1973"
 
 
-class LostDecadeJapan1991(EventModule):
+class LostDecadeJapan1991(TableCrisis):
     """
     https://en.wikipedia.org/wiki/Lost_Decade_(Japan)
     Stagnation: Asset price BUBBLE + collapse
@@ -79,41 +195,10 @@ class LostDecadeJapan1991(EventModule):
     2005: 600
     """
 
-    def next_year(self):
-        multiply_mean_inflation = self.get_prop_multiplier("main.environment.Inflation", "inflation_mean")
-
-        multiply_stocks = self.get_prop_multiplier("assets.stocks.Stocks", "asset_value")
-        multiply_gold = self.get_prop_multiplier("assets.resources.Gold", "asset_value")
-
-        # # TODO better handling of module start values
-        inflation_mean_start = self.manager.get_module("main.environment.Inflation").inflation_mean_start
-
-        if self.crisis_year < 1:  # 1987, start
-            multiply_mean_inflation(1/inflation_mean_start)
-            multiply_stocks(1.205)
-            multiply_gold(0.9319)
-        elif self.crisis_year < 3:  # 1990, bubble max
-            multiply_mean_inflation(1.00741707178)  # 1.03**(1/4)
-            multiply_stocks(1.205)
-            multiply_gold(0.9319)
-        elif self.crisis_year < 5:  # 1992, crash
-            multiply_mean_inflation(1.00741707178)  # 1.03**(1/4)
-            multiply_stocks(0.71)
-            multiply_gold(0.9319)
-        elif self.crisis_year < 13:  # 2000, low
-            multiply_mean_inflation(0.99506)  # (0.99/1.03)**(1/8)
-            multiply_stocks(0.975)
-            multiply_gold(0.9319)
-        elif self.crisis_year < 18:  # 2005, recovery
-            multiply_mean_inflation(1.002)  # (1/0.99)**(1/5)
-            multiply_stocks(0.975)
-            multiply_gold(1.0845)
-        else:  # reset
-            multiply_mean_inflation(inflation_mean_start)
-            self.active = False
+    table = "LostDecadeJapan1991"
 
 
-class GreatRecession2007(EventModule):
+class GreatRecession2007(TableCrisis):
     """
     https://en.wikipedia.org/wiki/Great_Recession
     Recession + Housing price BUBBLE
@@ -148,39 +233,10 @@ class GreatRecession2007(EventModule):
 
     """
 
-    def next_year(self):
-        multiply_prob_lose_job = self.get_prop_multiplier("main.work.Job", "prob_lose_job")
-        multiply_prob_find_job = self.get_prop_multiplier("main.work.Job", "prob_find_job")
-        multiply_mean_inflation = self.get_prop_multiplier("main.environment.Inflation", "inflation_mean")
-        # add_mean_inflation = self.get_prop_adder("main.environment.Inflation", "inflation_mean")
-        multiply_stocks = self.get_prop_multiplier("assets.stocks.Stocks", "asset_value")
-        multiply_gold = self.get_prop_multiplier("assets.resources.Gold", "asset_value")
-
-        # TODO better handling of module start values
-        inflation_mean_start = self.manager.get_module("main.environment.Inflation").inflation_mean_start
-
-        # start 2005
-        if self.crisis_year < 4:  # till 2008
-            multiply_stocks(1.12468)
-            multiply_gold(1.164)
-        elif self.crisis_year == 4:  # 2009, crash
-            multiply_prob_lose_job(2)
-            multiply_prob_find_job(0.5)
-            multiply_mean_inflation(0.995/inflation_mean_start)
-            multiply_stocks(0.5)
-            multiply_gold(1.164)
-        elif self.crisis_year == 5:  # 2010
-            multiply_mean_inflation(1.01/0.995)
-            multiply_stocks(1.5)
-            multiply_gold(1.164)
-        else:  # reset
-            multiply_prob_lose_job(0.5)
-            multiply_prob_find_job(2)
-            multiply_mean_inflation(inflation_mean_start/1.01)
-            self.active = False
+    table = "GreatRecession2007"
 
 
-class GermanHyperinflation1914(EventModule):
+class GermanHyperinflation1914(TableCrisis):
     # TODO Test outcome: divided by inflation everything is the same
     # TODO what happened to retail?
     """
@@ -239,47 +295,4 @@ class GermanHyperinflation1914(EventModule):
     1924: 122RM (*1.02)
     """
 
-    def next_year(self):
-        multiply_salary_increase = self.get_prop_multiplier("main.work.Job", "salary_increase_mod")
-        multiply_mean_inflation = self.get_prop_multiplier("main.environment.Inflation", "inflation_mean")
-        multiply_stocks = self.get_prop_multiplier("assets.stocks.Stocks", "asset_value")
-        multiply_gold = self.get_prop_multiplier("assets.resources.Gold", "asset_value")
-        multiply_current_account = self.get_prop_multiplier("CurrentAccount", "money_value")
-
-        if self.crisis_year == 0:  # 1919
-            multiply_mean_inflation(2/1.02)
-            multiply_gold(150/100)
-            multiply_salary_increase(1.04/2.)
-        elif self.crisis_year == 1:  # 1920
-            multiply_mean_inflation(2.5/2.)
-            multiply_gold(1000/150)
-            multiply_salary_increase(2./2.5)
-        elif self.crisis_year == 2:  # 1921
-            multiply_mean_inflation(3./2.5)
-            multiply_stocks(2)
-            multiply_salary_increase(2.5/3)
-        elif self.crisis_year == 3:  # 1922
-            multiply_mean_inflation(6.5/3.)
-            multiply_gold(3)
-            multiply_stocks(5)
-            multiply_salary_increase(1.01/1.04*3./6.5)
-        elif self.crisis_year == 4:  # 1923
-            multiply_mean_inflation(50./6.5)
-            multiply_gold(40)  # TODO gold had to be sold! if above limit of 10 gold mark
-            multiply_stocks(10)
-            multiply_salary_increase(0.88/1.01*6.5/50)
-        elif self.crisis_year == 5:  # 1924
-            multiply_mean_inflation(1e8/50)
-            multiply_gold(10000000000/12)
-            multiply_stocks(2000000000)
-            multiply_salary_increase(1.02/0.88 * 50/1e8)
-        elif self.crisis_year == 6:  # 1925 money reform
-            multiply_mean_inflation(2e-20)  # hack factor 1/2 because missing first years 1914-1918
-            multiply_gold(1e-12)
-            multiply_stocks(1e-12)
-            multiply_current_account(1e-12)
-            multiply_salary_increase(1/1.02 * 1/2e-20)
-        else:
-            multiply_mean_inflation(0.5*1.02e12)
-            multiply_salary_increase(2e-12)
-            self.active = False
+    table = "GermanHyperinflation1914"
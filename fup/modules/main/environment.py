@@ -1,4 +1,4 @@
-import random
+import numpy as np
 from fup.core.module import Module
 
 
@@ -10,14 +10,39 @@ class Inflation(Module):
         self.inflation_std = inflation_std
         self.inflation = 1
         self.total_inflation = 1
+        self.inflations = None  # (total) inflation and normal numbers of all years, if precomputed
+        self.total_inflations = None
+        self.normals = None
 
-    def next_year(self):
+    def declare_columns(self, schema):
+        super().declare_columns(schema)
+        schema.declare("inflation")
+        schema.declare("total_inflation")
+        self.manager.declare_random_driver(self.name)
+
+    def precompute(self, years):
+        # no inputs from other modules: the yearly inflation at once and the same products as year by year
         if self.config["simulation"]["random"]:
-            self.inflation = self.inflation_mean * max(random.gauss(mu=1, sigma=self.inflation_std), 1e-30)
+            self.normals = self.manager.random.normal_path(self.name, years)
+            self.inflations = self.inflation_mean * np.maximum(1 + self.inflation_std * self.normals, 1e-30)
         else:
-            self.inflation = self.inflation_mean
+            self.inflations = np.full(years, self.inflation_mean)
+        start = np.ones_like(self.inflations[:1]) * self.total_inflation
+        self.total_inflations = np.cumprod(np.concatenate([start, self.inflations]), axis=0)[1:]
 
-        self.total_inflation *= self.inflation
+    def next_year(self):
+        if self.inflations is not None:
+            year_index = self.manager.year_index
+            self.inflation = self.inflations[year_index]
+            self.total_inflation = self.total_inflations[year_index]
+            if self.normals is not None:
+                self.manager.random.account_normal(self.name, self.normals[year_index])
+        else:
+            if self.config["simulation"]["random"]:
+                self.inflation = self.inflation_mean * np.maximum(self.manager.random.normal(self.name, mu=1, sigma=self.inflation_std), 1e-30)
+            else:
+                self.inflation = self.inflation_mean
+            self.total_inflation *= self.inflation
 
         self.df_row["inflation"] = self.inflation
         self.df_row["total_inflation"] = self.total_inflation
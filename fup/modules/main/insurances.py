@@ -1,21 +1,38 @@
+import numpy as np
 from fup.core.module import ChangeModule
 
 
 class Health(ChangeModule):
+    reads = {"main.environment.Inflation": ["inflation"], "main.work.Job": ["income"],
+             "main.insurances.Pension": ["income"]}
+
+    def link(self):
+        self.get_inflation = self.get_prop_getter("main.environment.Inflation", "inflation")
+        self.get_job_income = self.get_prop_getter("main.work.Job", "income")
+        self.get_pension_income = self.get_prop_getter("main.insurances.Pension", "income")
+
     def next_year(self):
-        inflation = self.get_prop("main.environment.Inflation", "inflation")
+        inflation = self.get_inflation()
         self.income_threshold *= inflation
-        income = self.get_prop("main.work.Job", "income") + self.get_prop("main.insurances.Pension", "income")
-        capped_income = min(income, self.income_threshold)
+        income = self.get_job_income() + self.get_pension_income()
+        capped_income = np.minimum(income, self.income_threshold)
         self.expenses = capped_income * self.fraction_of_income
 
 
 class NursingCare(ChangeModule):
+    reads = {"main.environment.Inflation": ["inflation"], "main.work.Job": ["income"],
+             "main.insurances.Pension": ["income"]}
+
+    def link(self):
+        self.get_inflation = self.get_prop_getter("main.environment.Inflation", "inflation")
+        self.get_job_income = self.get_prop_getter("main.work.Job", "income")
+        self.get_pension_income = self.get_prop_getter("main.insurances.Pension", "income")
+
     def next_year(self):
-        inflation = self.get_prop("main.environment.Inflation", "inflation")
+        inflation = self.get_inflation()
         self.income_threshold *= inflation
-        income = self.get_prop("main.work.Job", "income") + self.get_prop("main.insurances.Pension", "income")
-        capped_income = min(income, self.income_threshold)
+        income = self.get_job_income() + self.get_pension_income()
+        capped_income = np.minimum(income, self.income_threshold)
         if self.manager.profile.retired:
             self.expenses = capped_income * self.fraction_of_income * self.retirement_factor
         else:
@@ -23,25 +40,31 @@ class NursingCare(ChangeModule):
 
 
 class Pension(ChangeModule):
+    reads = {"main.environment.Inflation": ["inflation"], "main.work.Job": ["income"]}
+
+    def link(self):
+        self.get_inflation = self.get_prop_getter("main.environment.Inflation", "inflation")
+        self.get_job_income = self.get_prop_getter("main.work.Job", "income")
+
     @property
     def expected_income(self):
         # without inflation => inflation normalized income
         # expect to have similar income until retirement
-        job_income = self.get_prop("main.work.Job", "income")
-        capped_income = min(job_income, self.income_threshold)
+        job_income = self.get_job_income()
+        capped_income = np.minimum(job_income, self.income_threshold)
         new_entgeldpunkte = capped_income / self.durchschnittseinkommen
         years_till_retirement = max((self.config["profile"]["retirement_year"] - self.manager.year), 0)
         expected_entgeldpunkte = self.entgeltpunkte + years_till_retirement * new_entgeldpunkte
         return expected_entgeldpunkte * self.rentenwert * 12
 
     def next_year(self):
-        inflation = self.get_prop("main.environment.Inflation", "inflation")
-        job_income = self.get_prop("main.work.Job", "income")
+        inflation = self.get_inflation()
+        job_income = self.get_job_income()
         self.rentenwert *= inflation
         self.durchschnittseinkommen *= inflation
         self.income_threshold *= inflation
         if not self.manager.profile.retired:
-            capped_income = min(job_income, self.income_threshold)
+            capped_income = np.minimum(job_income, self.income_threshold)
             self.entgeltpunkte += capped_income / self.durchschnittseinkommen
             self.expenses = self.fraction_of_income * capped_income
         else:
@@ -49,17 +72,27 @@ class Pension(ChangeModule):
 
 
 class Unemployment(ChangeModule):
+    reads = {"main.work.Job": ["salary_per_month", "income", "unemployed_months", "unemployed_months_this_year"],
+             "main.environment.Inflation": ["inflation"]}
+
+    def link(self):
+        self.get_salary_per_month = self.get_prop_getter("main.work.Job", "salary_per_month")
+        self.get_job_income = self.get_prop_getter("main.work.Job", "income")
+        self.get_unemployed_months = self.get_prop_getter("main.work.Job", "unemployed_months")
+        self.get_unemployed_months_this_year = self.get_prop_getter("main.work.Job", "unemployed_months_this_year")
+        self.get_inflation = self.get_prop_getter("main.environment.Inflation", "inflation")
+
     def next_year(self):
         birth_year = self.config["profile"]["birth_year"]
-        salary_per_month = self.get_prop("main.work.Job", "salary_per_month")
-        job_income = self.get_prop("main.work.Job", "income")
-        unemployed_months = self.get_prop("main.work.Job", "unemployed_months")
-        unemployed_months_this_year = self.get_prop("main.work.Job", "unemployed_months_this_year")
-        inflation = self.get_prop("main.environment.Inflation", "inflation")
+        salary_per_month = self.get_salary_per_month()
+        job_income = self.get_job_income()
+        unemployed_months = self.get_unemployed_months()
+        unemployed_months_this_year = self.get_unemployed_months_this_year()
+        inflation = self.get_inflation()
 
         self.income_threshold *= inflation
 
-        capped_income = min(job_income, self.income_threshold)
+        capped_income = np.minimum(job_income, self.income_threshold)
 
         # Paying money
         if self.manager.profile.retired:
@@ -67,16 +100,14 @@ class Unemployment(ChangeModule):
         else:
             self.expenses = capped_income * self.fraction_of_income
 
-        # Getting money
-        if unemployed_months_this_year > 0:
-            capped_salary_per_month = min(salary_per_month, self.income_threshold / 12)
-            months_you_get_unemployment_money = self.months_you_get_unemployment_money
-            if self.manager.year - birth_year > 54:
-                months_you_get_unemployment_money = 24
-            month_you_get_money = unemployed_months_this_year
-            if unemployed_months > months_you_get_unemployment_money:
-                month_you_get_money -= (unemployed_months - months_you_get_unemployment_money)
-            month_you_get_money = max(month_you_get_money, 0)
-
-            # TODO better formula to get unemployment money
-            self.income = month_you_get_money * capped_salary_per_month * self.salary_fraction
+        # Getting money, nothing for runs without unemployed months this year
+        capped_salary_per_month = np.minimum(salary_per_month, self.income_threshold / 12)
+        months_you_get_unemployment_money = self.months_you_get_unemployment_money
+        if self.manager.year - birth_year > 54:
+            months_you_get_unemployment_money = 24
+        month_you_get_money = unemployed_months_this_year - \
+            np.maximum(unemployed_months - months_you_get_unemployment_money, 0)
+        month_you_get_money = np.maximum(month_you_get_money, 0)
+
+        # TODO better formula to get unemployment money
+        self.income = month_you_get_money * capped_salary_per_month * self.salary_fraction
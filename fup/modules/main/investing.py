@@ -1,13 +1,29 @@
-from fup.core.module import ChangeModule
+from fup.core.module import ChangeModule, CURRENT_ACCOUNT
 
 
 class Investing(ChangeModule):
+    @classmethod
+    def get_reads(cls, build_config):
+        return {asset: ["money_value"] for asset in build_config["assets_ratios"]}
+
+    @classmethod
+    def get_writes(cls, build_config):
+        # buys and sells the assets with the money of the current account
+        writes = {asset: ["count", "asset_value"] for asset in build_config["assets_ratios"]}
+        writes[CURRENT_ACCOUNT] = ["money_value"]
+        return writes
+
+    def link(self):
+        self.asset_getters = tuple((ratio, self.get_prop_getter(asset, "money_value"),
+                                    self.get_prop_getter(asset, "change"))
+                                   for asset, ratio in self.assets_ratios.items())
+
     def next_year(self):
         total_assets = self.manager.total_assets
         change_money = self.manager.current_account.change
 
-        for asset, ratio in self.assets_ratios.items():
-            value = self.get_prop(asset, "money_value")
-            change_asset = self.get_prop(asset, "change")
+        for ratio, get_value, get_change in self.asset_getters:
+            value = get_value()
+            change_asset = get_change()
             delta = ratio * total_assets - value
             change_money(money=change_asset(money=delta))
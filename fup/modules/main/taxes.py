@@ -1,47 +1,65 @@
 import numpy as np
-import pandas as pd
 from fup.core.module import ChangeModule
 
 
+def interpolate_tax_rate(taxable_income, thresholds, tax_rates, inflation_index=1):
+    """
+    Linear interpolation of the tax rate between the thresholds, constant outside.
+    The thresholds are given in prices of the start year, inflation_index (e.g. the total inflation since) scales them
+    to the current prices. taxable_income and inflation_index can be vectors of the runs of a batch.
+    """
+    tax_rate = np.interp(np.divide(taxable_income, inflation_index), thresholds, tax_rates)
+    return tax_rate if tax_rate.ndim else tax_rate.item()
+
+
 class Taxes(ChangeModule):
     def __init__(self, tax_rates, tax_offsets, taxable_incomes, church_tax_rate=0,
                  name="", manager=None, **kwargs):
         super().__init__(name=name, manager=manager, **kwargs)
-        self.tax_rates = pd.DataFrame(tax_rates)
+        self.tax_thresholds = np.array([row["taxable_income"] for row in tax_rates], dtype=float)  # start year prices
+        self.tax_rates = np.array([row["tax_rate"] for row in tax_rates], dtype=float)
         self.church_tax_rate = church_tax_rate
         self.tax_offsets = tax_offsets
         self.taxable_incomes = taxable_incomes
 
+        self.inflation_index = 1  # scales the tax thresholds to the current prices
         self.tax_rate = 0
         self.tax_offset = 0
         self.taxable_income = 0
 
+    @classmethod
+    def get_reads(cls, build_config):
+        reads = {"main.environment.Inflation": ["inflation"]}
+        for expense in build_config["tax_offsets"]:
+            reads.setdefault(expense, []).append("expenses")
+        for income in build_config["taxable_incomes"]:
+            reads.setdefault(income, []).append("income")
+        return reads
+
+    def declare_columns(self, schema):
+        super().declare_columns(schema)
+        schema.declare("tax")
+        schema.declare("tax_offset")
+
+    def link(self):
+        self.get_inflation = self.get_prop_getter("main.environment.Inflation", "inflation")
+        self.tax_offset_getters = tuple(self.get_prop_getter(expense, "expenses") for expense in self.tax_offsets)
+        self.taxable_income_getters = tuple(self.get_prop_getter(income, "income") for income in self.taxable_incomes)
+
     def next_year(self):
-        inflation = self.get_prop("main.environment.Inflation", "inflation")
-        self.tax_rates["taxable_income"] *= inflation
+        self.inflation_index = self.inflation_index * self.get_inflation()
 
         self.tax_offset = 0
         self.taxable_income = 0
-        for expense in self.tax_offsets:
-            self.tax_offset += self.get_prop(expense, "expenses")
-        for income in self.taxable_incomes:
-            self.taxable_income += self.get_prop(income, "income")
+        for get_expenses in self.tax_offset_getters:
+            self.tax_offset += get_expenses()
+        for get_income in self.taxable_income_getters:
+            self.taxable_income += get_income()
         self.taxable_income -= self.tax_offset
-        self.taxable_income = max(0, self.taxable_income)
-
-        index_tax_max = np.searchsorted(self.tax_rates.taxable_income, self.taxable_income)
-        index_tax_min = index_tax_max - 1
-
-        if index_tax_min < 0:
-            self.tax_rate = self.tax_rates.tax_rate[0]
-        elif index_tax_max >= len(self.tax_rates):
-            self.tax_rate = self.tax_rates.tax_rate[len(self.tax_rates) - 1]
-        else:
-            tax_rate_min = self.tax_rates.tax_rate[index_tax_min]
-            taxable_income_min = self.tax_rates.taxable_income[index_tax_min]
-            tax_rate_max = self.tax_rates.tax_rate[index_tax_max]
-            taxable_income_max = self.tax_rates.taxable_income[index_tax_max]
-            self.tax_rate = tax_rate_min + (self.taxable_income - taxable_income_min) / (taxable_income_max - taxable_income_min) * (tax_rate_max - tax_rate_min)
+        self.taxable_income = np.maximum(0, self.taxable_income)
+
+        self.tax_rate = interpolate_tax_rate(self.taxable_income, self.tax_thresholds, self.tax_rates,
+                                             inflation_index=self.inflation_index)
 
         if self.church_tax_rate > 0:
             self.tax_rate *= 1. + self.church_tax_rate/100
@@ -1,5 +1,64 @@
-import random
+import collections
+import functools
+
+import numpy as np
+
 from fup.core.module import ChangeModule
+from fup.core.functions import where
+
+
+@functools.lru_cache(maxsize=1024)
+def get_employment_year_distribution(prob_lose_job, prob_find_job, unemployed):
+    """
+    Outcomes of the monthly employment chain over one year: each month an employed person loses the job with
+    prob_lose_job, an unemployed one finds a job with prob_find_job.
+    unemployed: whether the year starts unemployed
+    Returns (spell_months, months_this_year, cumulative probability) of the outcomes, with spell_months the months of
+    the spell at the end of the year counted within this year, 0 if employed, -1 for a spell lasting since last year.
+    """
+    outcomes = {(-1 if unemployed else 0, 0): 1.}
+    for month in range(12):
+        next_outcomes = collections.defaultdict(float)
+        for (spell_months, months_this_year), probability in outcomes.items():
+            if spell_months == 0:
+                next_outcomes[(1, months_this_year + 1)] += probability * prob_lose_job
+                next_outcomes[(0, months_this_year)] += probability * (1 - prob_lose_job)
+            else:
+                next_outcomes[(0, months_this_year)] += probability * prob_find_job
+                next_outcomes[(spell_months + 1 if spell_months > 0 else -1, months_this_year + 1)] += \
+                    probability * (1 - prob_find_job)
+        outcomes = next_outcomes
+    spell_months, months_this_year = np.array(list(outcomes.keys())).T
+    return spell_months, months_this_year, np.cumsum(list(outcomes.values()))
+
+
+def draw_employment_year(unemployed_months, prob_lose_job, prob_find_job, draw):
+    """
+    Draw (unemployed_months, unemployed_months_this_year) after one year of the monthly employment chain from a
+    single uniform draw, by the inverse of the distribution of the outcomes. All arguments can be vectors of runs.
+    """
+    if np.ndim(unemployed_months) == np.ndim(prob_lose_job) == np.ndim(prob_find_job) == np.ndim(draw) == 0:
+        spell_months, months_this_year, cdf = get_employment_year_distribution(
+            float(prob_lose_job), float(prob_find_job), bool(unemployed_months > 0))
+        i = min(np.searchsorted(cdf, draw, side="right"), len(cdf) - 1)
+        end_months = unemployed_months + 12 if spell_months[i] < 0 else spell_months[i]
+        return int(end_months), int(months_this_year[i])
+
+    unemployed_months, prob_lose_job, prob_find_job, draw = np.broadcast_arrays(unemployed_months, prob_lose_job,
+                                                                               prob_find_job, draw)
+    end_months = np.empty(draw.shape, dtype=int)
+    months_this_year = np.empty(draw.shape, dtype=int)
+    # runs with the same probabilities and start state share one distribution
+    chains, chain_index = np.unique(np.stack([prob_lose_job, prob_find_job, unemployed_months > 0], axis=-1),
+                                    axis=0, return_inverse=True)
+    for i_chain, (p_lose, p_find, unemployed) in enumerate(chains):
+        runs = chain_index.reshape(-1) == i_chain
+        spell_months, chain_months_this_year, cdf = get_employment_year_distribution(
+            float(p_lose), float(p_find), bool(unemployed))
+        i = np.minimum(np.searchsorted(cdf, draw[runs], side="right"), len(cdf) - 1)
+        end_months[runs] = np.where(spell_months[i] < 0, unemployed_months[runs] + 12, spell_months[i])
+        months_this_year[runs] = chain_months_this_year[i]
+    return end_months, months_this_year
 
 
 class Job(ChangeModule):
@@ -10,6 +69,8 @@ class Job(ChangeModule):
     - Compensation
     """
 
+    reads = {"main.environment.Inflation": ["inflation"]}
+
     def __init__(self, start_income, prob_find_job, prob_lose_job, unemployed_months=0,
                  salary_increase_mod=1, name="", manager=None, **kwargs):
         super().__init__(name=name, manager=manager, **kwargs)
@@ -23,7 +84,11 @@ class Job(ChangeModule):
         self.unemployed_months = unemployed_months
         self.unemployed_months_this_year = 0
 
-    def get_age_salary_increase(self):
+    def declare_columns(self, schema):
+        super().declare_columns(schema)
+        self.manager.declare_random_driver(self.name, normal=False)
+
+    def get_age_salary_increase(self, year=None):
         """
         income increase https://www.stepstone.de/gehaltspotenzial-rechner
         years: gross income (average germany)
@@ -33,32 +98,28 @@ class Job(ChangeModule):
 
         IMPORTANT: such big increases are only possible by changing jobs!
         """
-        age = self.manager.year - self.manager.profile.birth_year
-        if age < 50:
-            return 1.0227
-        else:
-            return 0.993
+        age = (self.manager.year if year is None else year) - self.manager.profile.birth_year
+        return where(age < 50, 1.0227, 0.993)
+
+    def link(self):
+        self.get_inflation = self.get_prop_getter("main.environment.Inflation", "inflation")
+        # a function of the year only, for all years at once, plain floats as in single runs
+        self.age_salary_increases = self.get_age_salary_increase(
+            year=np.arange(self.config["simulation"]["start_year"], self.config["simulation"]["end_year"]) + 1).tolist()
 
     def next_year(self):
-        inflation = self.get_prop("main.environment.Inflation", "inflation")
-        self.salary_per_month *= inflation * self.salary_increase_mod * self.get_age_salary_increase()
+        inflation = self.get_inflation()
+        self.salary_per_month *= inflation * self.salary_increase_mod \
+            * self.age_salary_increases[self.manager.year_index]
 
         if self.manager.profile.retired:
             self.unemployed_months_this_year = 0
             return
 
         if self.config["simulation"]["random"]:
-            self.unemployed_months_this_year = 0
-            for i in range(12):  # 12 months
-                if self.unemployed_months > 0:
-                    if random.random() < self.prob_find_job:
-                        self.unemployed_months = 0
-                    else:
-                        self.unemployed_months += 1
-                        self.unemployed_months_this_year += 1
-                else:
-                    if random.random() < self.prob_lose_job:
-                        self.unemployed_months = 1
-                        self.unemployed_months_this_year += 1
+            # the 12 months of the chain at once, with the probabilities of this year (which events may change)
+            self.unemployed_months, self.unemployed_months_this_year = draw_employment_year(
+                self.unemployed_months, self.prob_lose_job, self.prob_find_job,
+                draw=self.manager.random.uniform(self.name))
 
         self.income = (12 - self.unemployed_months_this_year) * self.salary_per_month
@@ -1,3 +1,7 @@
+from fup.core.functions import register_class
+
+
+@register_class
 class FullInvestment:
     def __init__(self, manager, birth_year, retirement_year, married=False, partner=False, children=0):
         self.manager = manager
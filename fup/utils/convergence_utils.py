@@ -0,0 +1,210 @@
+import statistics
+
+import numpy as np
+import pandas as pd
+
+
+class MonteCarloStatistic:
+    """
+    A statistic over the runs of one value per run, column reduced over the years by over_years
+    ("last", "first", "min", "max", "mean" or the index of a year).
+    Estimates the mean of the values, the probability of values below `below`, or their quantile,
+    with the confidence interval of the Monte-Carlo error.
+    precision: half width of the confidence interval to reach, None for no target.
+
+    MonteCarloStatistic("assets median at the end", column="assets_cor", quantile=0.5, precision=5000)
+    MonteCarloStatistic("bankruptcy", column="assets_cor", over_years="min", below=0, precision=0.01)
+    MonteCarloStatistic("expenses mean", column="expenses_net_cor", over_years="mean", precision=100)
+    """
+
+    def __init__(self, name, column, over_years="last", quantile=None, below=None, precision=None):
+        assert quantile is None or below is None
+        self.name = name
+        self.column = column
+        self.over_years = over_years
+        self.quantile = quantile
+        self.below = below
+        self.precision = precision
+
+    def get_year_index(self):
+        return self.over_years if isinstance(self.over_years, int) else 0 if self.over_years == "first" else -1
+
+    def get_values(self, result):
+        values = result[self.column]
+        if isinstance(self.over_years, int) or self.over_years in ("last", "first"):
+            return values[:, self.get_year_index()]
+        return getattr(np, self.over_years)(values, axis=1)
+
+    def get_controls(self, result):
+        """
+        Control variates (columns "control.<stream>" of RandomStreams.get_control) of the year of the statistic,
+        the last year if reduced over all years, as (runs, controls) array.
+        """
+        columns = [column for column in result.schema.columns if column.startswith("control.")]
+        return np.stack([result[column][:, self.get_year_index()] for column in columns], axis=1) if columns \
+            else np.zeros((result.runs, 0))
+
+    def get_likelihood_ratios(self, result):
+        """
+        Weights of the runs for importance sampled results (simulation: importance_sampling), up to the year of the
+        statistic, otherwise None
+        """
+        if "likelihood_ratio" not in result.schema:
+            return None
+        return result["likelihood_ratio"][:, self.get_year_index()]
+
+    def estimate(self, values, confidence=0.95, controls=None, pairs=None, likelihood_ratios=None):
+        """
+        (estimate, standard error, confidence interval low, high) of the statistic of values
+        controls: (runs, controls) array of control variates with expectation 0, to correct the estimate
+        pairs: pair number of each run for antithetic runs, the runs of a pair are averaged for the errors
+        likelihood_ratios: weights of importance sampled runs
+        """
+        n = len(values)
+        z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+        controls = None if controls is None or controls.shape[1] == 0 else controls
+        independent = controls is None and pairs is None and likelihood_ratios is None
+        if self.below is not None:
+            p, std_error = get_mean_estimate(values < self.below, controls, pairs, likelihood_ratios)
+            p = float(np.clip(p, 0, 1))
+            # Wilson score interval, does not collapse for probabilities of 0 or 1
+            n = n if independent or std_error == 0 else p * (1 - p) / std_error ** 2  # effective number of runs
+            center = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+            half_width = z / (1 + z ** 2 / n) * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2))
+            return p, std_error, min(center - half_width, p), max(center + half_width, p)
+        if self.quantile is not None:
+            # interval of the order statistics around the quantile, in terms of the (corrected) distribution function
+            q = self.quantile
+            order = np.argsort(values)
+            sorted_values = values[order]
+            weights = np.ones(n) if likelihood_ratios is None else likelihood_ratios / np.mean(likelihood_ratios)
+            cdf = np.cumsum(weights[order]) / n
+            if controls is not None:
+                weighted = controls * weights[:, None]
+                centered = weighted - weighted.mean(axis=0)
+                coefficients = np.linalg.lstsq(np.atleast_2d(np.cov(weighted, rowvar=False)), weighted.mean(axis=0),
+                                               rcond=None)[0]
+                cdf = np.maximum.accumulate(cdf - np.cumsum(centered[order] @ coefficients) / (n - 1))
+            if controls is None and likelihood_ratios is None:
+                estimate = np.quantile(values, q)
+            else:
+                estimate = sorted_values[min(np.searchsorted(cdf, q), n - 1)]
+            if independent:
+                std_error = np.sqrt(q * (1 - q) / n)
+            else:
+                std_error = get_mean_estimate(values <= estimate, controls, pairs, likelihood_ratios)[1]
+            low = sorted_values[min(np.searchsorted(cdf, q - z * std_error), n - 1)]
+            high = sorted_values[min(np.searchsorted(cdf, q + z * std_error), n - 1)]
+            return estimate, (high - low) / (2 * z), low, high
+        mean, std_error = get_mean_estimate(values, controls, pairs, likelihood_ratios)
+        return mean, std_error, mean - z * std_error, mean + z * std_error
+
+
+def get_mean_estimate(values, controls=None, pairs=None, likelihood_ratios=None):
+    """
+    Mean of values, weighted by the likelihood ratios (self-normalized) and corrected by the control variates,
+    and its standard error
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.ones(len(values)) if likelihood_ratios is None else likelihood_ratios / np.mean(likelihood_ratios)
+    mean = np.average(values, weights=weights)
+    residuals = weights * (values - mean)
+    if controls is not None:
+        residuals = get_corrected(residuals, controls * weights[:, None])
+    return mean + np.mean(residuals), get_std_error(residuals, pairs)
+
+
+def get_corrected(values, controls):
+    """
+    Values minus their regression on the control variates (with expectation 0), same expectation but less variance.
+    """
+    centered = controls - controls.mean(axis=0)
+    beta = np.linalg.lstsq(centered, values - values.mean(), rcond=None)[0]
+    return values - controls @ beta
+
+
+def get_std_error(values, pairs=None):
+    if pairs is not None:
+        _, pair_index = np.unique(pairs, return_inverse=True)
+        values = np.bincount(pair_index, weights=values) / np.bincount(pair_index)
+    n = len(values)
+    return np.std(values, ddof=1) / np.sqrt(n) if n > 1 else np.inf
+
+
+class ConvergenceMonitor:
+    """
+    Tracks the Monte-Carlo errors of statistics over the chunks of runs of run_simulations (as aggregator)
+    and tells when all reached their precision (until=monitor.converged).
+    antithetic: the runs are antithetic pairs (simulation: antithetic)
+    control_variates: correct the estimates with the control columns of the results (simulation: control_variates)
+    Importance sampled runs are weighted by their likelihood ratios.
+    """
+
+    def __init__(self, statistics, confidence=0.95, min_runs=100, antithetic=False, control_variates=False):
+        self.statistics = statistics
+        self.confidence = confidence
+        self.min_runs = min_runs
+        self.antithetic = antithetic
+        self.control_variates = control_variates
+        self.values = {statistic.name: [] for statistic in statistics}
+        self.controls = {statistic.name: [] for statistic in statistics}
+        self.likelihood_ratios = {statistic.name: [] for statistic in statistics}
+        self.run_numbers = []
+
+    @property
+    def runs(self):
+        return sum(len(run_numbers) for run_numbers in self.run_numbers)
+
+    def update(self, result):
+        self.run_numbers += [result.run_numbers]
+        for statistic in self.statistics:
+            self.values[statistic.name] += [statistic.get_values(result)]
+            if self.control_variates:
+                self.controls[statistic.name] += [statistic.get_controls(result)]
+            likelihood_ratios = statistic.get_likelihood_ratios(result)
+            if likelihood_ratios is not None:
+                self.likelihood_ratios[statistic.name] += [likelihood_ratios]
+
+    def to_dataframe(self):
+        """
+        Estimate, standard error and confidence interval of each statistic
+        """
+        rows = []
+        for statistic in self.statistics:
+            values = np.concatenate(self.values[statistic.name])
+            controls = np.concatenate(self.controls[statistic.name]) if self.control_variates else None
+            pairs = np.concatenate(self.run_numbers) // 2 if self.antithetic else None
+            likelihood_ratios = np.concatenate(self.likelihood_ratios[statistic.name]) \
+                if self.likelihood_ratios[statistic.name] else None
+            estimate, std_error, low, high = statistic.estimate(values, confidence=self.confidence, controls=controls,
+                                                                pairs=pairs, likelihood_ratios=likelihood_ratios)
+            half_width = (high - low) / 2
+            rows += [dict(statistic=statistic.name, estimate=estimate, std_error=std_error, ci_low=low, ci_high=high,
+                          half_width=half_width, precision=statistic.precision, runs=len(values),
+                          converged=statistic.precision is None or bool(half_width <= statistic.precision))]
+        return pd.DataFrame(rows)
+
+    def converged(self):
+        return self.runs >= self.min_runs and bool(self.to_dataframe()["converged"].all())
+
+
+def run_until_converged(config, statistics, max_runs=100000, chunk_size=1000, confidence=0.95, min_runs=None,
+                        batch=True, workers=None, **kwargs):
+    """
+    Simulate chunks of runs until the confidence intervals of all statistics (MonteCarloStatistic) are within
+    their precision, or max_runs are reached.
+    With antithetic and control_variates in the simulation config the errors account for the pairs of runs and the
+    estimates are corrected by the control variates.
+    Returns the result of run_simulations for the runs used and the DataFrame of the statistics with the number of
+    runs and the achieved confidence intervals.
+    """
+    from fup.utils.simulation_utils import run_simulations  # utils -> simulation_utils -> utils
+
+    monitor = ConvergenceMonitor(statistics=statistics, confidence=confidence,
+                                 min_runs=chunk_size if min_runs is None else min_runs,
+                                 antithetic=config["simulation"].get("antithetic", False),
+                                 control_variates=config["simulation"].get("control_variates", False)
+                                 and config["simulation"]["random"])
+    df, _ = run_simulations(config=config, runs=max_runs, chunk_size=chunk_size, batch=batch, workers=workers,
+                            aggregator=monitor, until=monitor.converged, **kwargs)
+    return df, monitor.to_dataframe()
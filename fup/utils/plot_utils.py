@@ -1,6 +1,9 @@
 import numpy as np
+import pandas as pd
 from bokeh.plotting import figure
 from bokeh.models import NumeralTickFormatter, ColumnDataSource
+from fup.utils.quantile_utils import QuantileAggregator, get_weighted_percentiles
+from fup.utils.store_utils import ResultStore
 
 
 def percentile(n):
@@ -11,10 +14,38 @@ def percentile(n):
     return percentile_
 
 
-def create_plot(df, column, name, unit, color, legend_location="top_right"):
-    dfg = df.groupby("year", as_index=False).agg({
+def get_percentiles(df, column):
+    """
+    5, 25, 50, 75 and 95 percentiles of column per year, of a long format DataFrame, a QuantileAggregator
+    or a ResultStore. Runs are weighted by their likelihood ratio, if importance sampled.
+    """
+    if isinstance(df, (QuantileAggregator, ResultStore)):
+        df_percentiles = df.percentiles(column=column, percentiles=(5, 25, 50, 75, 95))
+        dfg = pd.concat({"year": df_percentiles[["year"]].rename(columns={"year": ""}),
+                         column: df_percentiles.drop(columns="year")}, axis=1)
+        return dfg
+
+    if "likelihood_ratio" in df.columns:
+        percentiles = (5, 25, 50, 75, 95)
+        rows = {year: get_weighted_percentiles(df_year[column].values, df_year["likelihood_ratio"].values,
+                                               percentiles)[0]
+                for year, df_year in df.groupby("year")}
+        dfg = pd.DataFrame(list(rows.values()), columns=pd.MultiIndex.from_product(
+            [[column], [f"percentile_{p}" for p in percentiles]]))
+        dfg.insert(0, ("year", ""), list(rows))
+        return dfg
+
+    return df.groupby("year", as_index=False).agg({
         column: [percentile(5), percentile(25), percentile(50), percentile(75), percentile(95)],
     })
+
+
+def create_plot(df, column, name, unit, color, legend_location="top_right"):
+    """
+    Fan chart of column over the years, df is a long format DataFrame of all runs, a QuantileAggregator
+    or a ResultStore
+    """
+    dfg = get_percentiles(df=df, column=column)
     source = ColumnDataSource(dfg)
     y_min = min(0, 1.1 * dfg[column]["percentile_5"].min())
     y_max = 1.1 * dfg[column]["percentile_95"].max()
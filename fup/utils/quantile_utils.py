@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+
+def get_weighted_percentiles(values, weights, percentiles):
+    """
+    Percentiles of weighted observations (e.g. by the likelihood ratios of importance sampling) of many cells,
+    values and weights: (observations, cells), returns (cells, len(percentiles))
+    """
+    values = np.asarray(values, dtype=float).reshape(len(values), -1)
+    weights = np.broadcast_to(np.asarray(weights, dtype=float).reshape(len(values), -1), values.shape)
+    order = np.argsort(values, axis=0)
+    values = np.take_along_axis(values, order, axis=0)
+    weights = np.take_along_axis(weights, order, axis=0)
+    cumulative_weights = np.cumsum(weights, axis=0) - weights / 2
+    cumulative_weights /= np.maximum(cumulative_weights[-1] + weights[-1] / 2, 1e-300)
+    q = np.asarray(percentiles) / 100.
+    return np.stack([np.interp(q, cumulative_weights[:, cell], values[:, cell]) for cell in range(values.shape[1])])
+
+
+class QuantileSketch:
+    """
+    Fixed memory quantile sketch for many cells at once, a merging t-digest with compression centroids per cell.
+    Observations are added batch by batch, each batch is merged into the centroids with vectorized numpy operations.
+    """
+
+    def __init__(self, cells, compression=200):
+        self.cells = cells
+        self.compression = compression
+        self.means = np.zeros((cells, compression))
+        self.weights = np.zeros((cells, compression))
+        self.min = np.full(cells, np.inf)
+        self.max = np.full(cells, -np.inf)
+
+    @property
+    def count(self):
+        return self.weights.sum(axis=1)
+
+    def update(self, values, weights=None):
+        """
+        values: (observations, cells), weights: of the observations, same shape, default 1
+        """
+        values = np.asarray(values, dtype=float).reshape(-1, self.cells).T
+        self.min = np.minimum(self.min, values.min(axis=1))
+        self.max = np.maximum(self.max, values.max(axis=1))
+
+        means = np.concatenate([self.means, values], axis=1)
+        weights = np.concatenate([self.weights, np.ones_like(values) if weights is None
+                                  else np.asarray(weights, dtype=float).reshape(-1, self.cells).T], axis=1)
+        order = np.argsort(means, axis=1, kind="stable")
+        means = np.take_along_axis(means, order, axis=1)
+        weights = np.take_along_axis(weights, order, axis=1)
+
+        # t-digest k-scale: small centroids in the tails, large ones around the median
+        cumulative_weights = np.cumsum(weights, axis=1)
+        quantiles = (cumulative_weights - weights / 2) / cumulative_weights[:, -1:]
+        k = np.floor(self.compression * (np.arcsin(2 * quantiles - 1) / np.pi + 0.5)).astype(int)
+        k = np.clip(k, 0, self.compression - 1) + np.arange(self.cells)[:, None] * self.compression
+
+        size = self.cells * self.compression
+        new_weights = np.bincount(k.ravel(), weights=weights.ravel(), minlength=size)
+        new_sums = np.bincount(k.ravel(), weights=(means * weights).ravel(), minlength=size)
+        self.weights = new_weights.reshape(self.cells, self.compression)
+        self.means = np.divide(new_sums, new_weights, out=np.zeros(size), where=new_weights > 0) \
+            .reshape(self.cells, self.compression)
+
+    def quantile(self, q):
+        """
+        Estimated q quantiles (0 <= q <= 1) of every cell, shape (cells, len(q))
+        """
+        q = np.atleast_1d(q)
+        out = np.full((self.cells, len(q)), np.nan)
+        for cell in range(self.cells):
+            filled = self.weights[cell] > 0
+            if not filled.any():
+                continue
+            weights = self.weights[cell][filled]
+            cumulative_weights = np.cumsum(weights)
+            x = np.concatenate([[0], (cumulative_weights - weights / 2) / cumulative_weights[-1], [1]])
+            y = np.concatenate([[self.min[cell]], self.means[cell][filled], [self.max[cell]]])
+            out[cell] = np.interp(q, x, y)
+        return out
+
+
+class QuantileAggregator:
+    """
+    Streaming per year quantiles of simulation results with constant memory, independent of the number of runs.
+    Feed it with SimulationResults (e.g. by run_simulations(aggregator=...)) and draw fan charts with create_plot.
+    Runs are weighted by their likelihood ratio, if importance sampled.
+    """
+    default_percentiles = (5, 25, 50, 75, 95)
+
+    def __init__(self, columns=None, compression=200):
+        self.columns = columns
+        self.compression = compression
+        self.years = None
+        self.sketch = None
+        self.runs = 0
+
+    def update(self, result):
+        if self.sketch is None:
+            if self.columns is None:
+                self.columns = [column for column in result.columns
+                                if column != "year" and result[column].dtype != object]
+            self.years = result.years
+            self.sketch = QuantileSketch(cells=len(self.years) * len(self.columns), compression=self.compression)
+        assert list(result.years) == list(self.years)
+        values = np.stack([result[column] for column in self.columns], axis=2)  # (runs, years, columns)
+        weights = None
+        if "likelihood_ratio" in result.schema:
+            weights = np.repeat(result["likelihood_ratio"][:, :, None], len(self.columns), axis=2) \
+                .reshape(result.runs, -1)
+        self.sketch.update(values.reshape(result.runs, -1), weights=weights)
+        self.runs += result.runs
+
+    def percentiles(self, column, percentiles=default_percentiles):
+        """
+        DataFrame with one row per year and one column per percentile
+        """
+        quantiles = self.sketch.quantile(np.array(percentiles) / 100.) \
+            .reshape(len(self.years), len(self.columns), len(percentiles))
+        values = quantiles[:, self.columns.index(column), :]
+        df = pd.DataFrame(values, columns=[f"percentile_{p}" for p in percentiles])
+        df.insert(0, "year", self.years)
+        return df
@@ -1,9 +1,20 @@
 import time
 import copy
+import json
+import os
+import collections
+import itertools
+import concurrent.futures
+import numpy as np
 import pandas as pd
 import networkx as nx
 from fup.core.manager import Manager
+from fup.core.module import resolve_current_account
+from fup.core.results import SimulationResult
+from fup.core.profiler import ModuleProfiler
+from fup.core.streams import DriverTape
 from fup.core.functions import get_module_blueprints, get_blueprint
+from fup.utils.store_utils import ResultStore
 import fup.profiles
 import fup.modules
 
@@ -16,60 +27,124 @@ def overwrite_config(a, b):
             a[key] = b[key]
 
 
-def get_sorted_module_names(modules):
+CURRENT_ACCOUNT_NAME = "CurrentAccount"  # module of the current account in the configs (Manager.current_account)
+END_OF_YEAR = "end_of_year"  # pseudo module between the modules of the year and the end of year modules
+STREAMING_CHUNK_SIZE = 1000  # default maximum of runs per chunk if the chunks are streamed and not kept
+
+
+def get_dependency_graph(module_blueprints, current_account_name=CURRENT_ACCOUNT_NAME):
+    """
+    Graph of the modules by the reads and writes their classes declare (Module.get_reads, Module.get_writes):
+    edges from the modules read to the modules reading them, from the modules modifying to the modules modified.
+    The end of year modules (run_end_of_year) are a phase after all others, with the pseudo module END_OF_YEAR in
+    between. Their edges to modules of the year concern the next year, these are marked with next_year=True.
+    Reads and writes of the current account (CURRENT_ACCOUNT) are edges of the module current_account_name.
+    """
+    end_of_year = {blueprint.name for blueprint in module_blueprints if blueprint.run_end_of_year}
     G = nx.DiGraph()
-    G.add_node("root")
+    G.add_nodes_from(blueprint.name for blueprint in module_blueprints)
+    for blueprint in module_blueprints:
+        if blueprint.run_end_of_year:
+            G.add_edge(END_OF_YEAR, blueprint.name)
+        else:
+            G.add_edge(blueprint.name, END_OF_YEAR)
+
+    def add_edge(first, then):
+        if first in G and then in G and first != then:  # modules not in the config are not waited for
+            G.add_edge(first, then, next_year=first in end_of_year and then not in end_of_year)
 
-    for module_name, module in modules.items():
-        if module.run_end_of_year:
-            continue
-        G.add_node(module_name)
-        for dep_name in module.depends_on_modules:
-            G.add_edge(dep_name, module_name)
-            # FIXME theoretical end_of_year module can appear here, too.
-            # FIXME instead add psedo end of year module and add dependencies
-        for modify_name in module.modifies_modules:
-            G.add_edge(module_name, modify_name)
+    for blueprint in module_blueprints:
+        for module_name in resolve_current_account(blueprint.build_class.get_reads(blueprint.build_config),
+                                                   current_account_name):
+            add_edge(module_name, blueprint.name)
+        for module_name in resolve_current_account(blueprint.build_class.get_writes(blueprint.build_config),
+                                                   current_account_name):
+            add_edge(blueprint.name, module_name)
+    return G
+
+
+def get_feedback_free_module_names(module_blueprints, current_account_name=CURRENT_ACCOUNT_NAME):
+    """
+    Modules of the year without incoming edges in the dependency graph: they read no other module and no module
+    (e.g. an event) modifies them, their values of all years can be computed ahead (Module.precompute).
+    The end of year phase only moves money between the modules (investing), its writes for the next year are no
+    feedback. Scheduled events (EventModule.scheduled) are woken by the event calendar of the manager and are not
+    precomputed.
+    """
+    G = get_dependency_graph(module_blueprints, current_account_name=current_account_name)
+    return [blueprint.name for blueprint in module_blueprints
+            if not blueprint.run_end_of_year and not blueprint.build_class.scheduled
+            and not any(not next_year for _, _, next_year in G.in_edges(blueprint.name, data="next_year"))]
+
+
+def get_sorted_module_names(module_blueprints, current_account_name=CURRENT_ACCOUNT_NAME):
+    G = get_dependency_graph(module_blueprints, current_account_name=current_account_name)
+    G.remove_edges_from([(first, then) for first, then, next_year in G.edges(data="next_year") if next_year])
     # check for loop
     try:
         cycle = nx.find_cycle(G, orientation="original")
         raise Exception(f"Dependency loop found: {cycle}")
     except nx.NetworkXNoCycle:
         pass
-    # add root dependencies
-    for node in G.nodes():
-        if node == "root":
-            continue
+    # add root dependencies, in reversed order: independent modules keep the order of the config
+    nodes = list(G.nodes())
+    G.add_node("root")
+    for node in reversed(nodes):
         if len(G.in_edges(node)) < 1:
             G.add_edge("root", node)
     # Traverse Graph
     sorted_module_names = list(reversed(list(nx.dfs_postorder_nodes(G, source="root"))))[1:]
-    return sorted_module_names
+    return [module_name for module_name in sorted_module_names if module_name != END_OF_YEAR]
+
+
+def get_config_fingerprint(config):
+    """
+    Structure of a config the dependency sorting depends on: module names, classes, run_end_of_year flags,
+    module names referenced in module configs and the profile class, but none of the numbers.
+    """
+    module_names = set(config["modules"])
+
+    def get_references(value):
+        if isinstance(value, dict):
+            return set(value).union(*[get_references(v) for v in value.values()])
+        if isinstance(value, (list, tuple)):
+            return set().union(*[get_references(v) for v in value])
+        return {value} if isinstance(value, str) else set()
+
+    modules = []
+    for name, build_config in config["modules"].items():
+        build_config = build_config or dict()
+        modules += [(name,
+                     build_config.get("class", name),
+                     bool(build_config.get("run_end_of_year", False)),
+                     tuple(sorted(get_references(build_config) & module_names)))]
+    return config["profile"]["class"], tuple(modules)
+
+
+SORTED_MODULE_NAMES_CACHE_SIZE = 32
+_sorted_module_names_cache = collections.OrderedDict()  # config fingerprint -> sorted, feedback free names, LRU
 
 
 # TODO put this method somewhere else, where??!
 def get_sorted_module_blueprints(config):
-    # imports Manager -> no cyclic imports!
     module_blueprints = get_module_blueprints(config=config, root_module=fup.modules)
-    profile_blueprint = get_blueprint(config=config["profile"], root_module=fup.profiles)
-
-    # dry run to get dependencies
-    manager = Manager(config=config,
-                      module_blueprints=module_blueprints,
-                      profile_blueprint=profile_blueprint,
-                      current_account_name="CurrentAccount")
-    manager.dependency_check()
 
-    sorted_module_names = get_sorted_module_names(modules=manager.modules)
+    fingerprint = get_config_fingerprint(config)
+    if fingerprint in _sorted_module_names_cache:
+        _sorted_module_names_cache.move_to_end(fingerprint)
+    else:
+        _sorted_module_names_cache[fingerprint] = (
+            get_sorted_module_names(module_blueprints=module_blueprints),
+            set(get_feedback_free_module_names(module_blueprints=module_blueprints)))
+        if len(_sorted_module_names_cache) > SORTED_MODULE_NAMES_CACHE_SIZE:
+            _sorted_module_names_cache.popitem(last=False)
 
+    sorted_module_names, feedback_free_module_names = _sorted_module_names_cache[fingerprint]
     sorted_modules = []
     for module_name in sorted_module_names:
         sorted_modules += [m for m in module_blueprints if m.name == module_name]
-    # FIXME remove special treatment of end of year
-    for module_name, module in manager.modules.items():
-        if module.run_end_of_year:
-            sorted_modules += [m for m in module_blueprints if m.name == module_name]
-
+    for module_blueprint in sorted_modules:
+        module_blueprint.feedback_free = module_blueprint.name in feedback_free_module_names
     return sorted_modules
 
 
@@ -83,7 +158,7 @@ def get_start_values(config):
     manager = fup.core.manager.Manager(config=config,
                                        module_blueprints=sorted_module_blueprints,
                                        profile_blueprint=profile_blueprint,
-                                       current_account_name="CurrentAccount")
+                                       current_account_name=CURRENT_ACCOUNT_NAME)
     manager.next_year()
     rows = []
     for module_name in manager.modules:
@@ -91,41 +166,326 @@ def get_start_values(config):
     return pd.DataFrame(rows)
 
 
-def run_simulations(config, runs=100, debug=False):
-    time_start = time.time()
-
-    sorted_module_blueprints = get_sorted_module_blueprints(config)
-    profile_blueprint = get_blueprint(config=config["profile"], root_module=fup.profiles)
-    dfs = []
-    stats = []
-    for i in range(runs):
+def simulate_runs(config, module_blueprints, profile_blueprint, first_run, runs, seed, batch=False, profile=False,
+                  tape=None):
+    """
+    Simulate the runs first_run, ..., first_run + runs - 1 into a SimulationResult.
+    With profile=True the modules are timed, see result.profiler.
+    With a tape (DriverTape) the driver numbers are replayed from it.
+    """
+    n_years = config["simulation"]["end_year"] - config["simulation"]["start_year"]
+    profiler = ModuleProfiler() if profile else None
+    if batch:
         manager = fup.core.manager.Manager(config=config,
-                                           module_blueprints=sorted_module_blueprints,
+                                           module_blueprints=module_blueprints,
                                            profile_blueprint=profile_blueprint,
-                                           current_account_name="CurrentAccount")
-
-        rows = []
-        for i_year in range(config["simulation"]["end_year"] - config["simulation"]["start_year"]):
+                                           current_account_name=CURRENT_ACCOUNT_NAME,
+                                           runs=runs, seed=seed, first_run=first_run)
+        manager.profiler = profiler
+        if tape is not None:
+            manager.random.use_tape(tape)
+        result = SimulationResult(schema=manager.schema, runs=runs, years=n_years, first_run=first_run)
+        manager.write_results(result=result, runs=slice(None))
+        for i_year in range(n_years):
             manager.next_year()
-            rows += [manager.df_row]
-        df = pd.DataFrame(rows)
-        df["run"] = i
-
-        # tax correction
-        df["expenses_net"] = df["expenses"] - df["tax"] - df["tax_offset"]
-        df["income_net"] = df["income"] - df["tax"] - df["tax_offset"]
-        # Inflation corrected
-        df["expenses_net_cor"] = df["expenses_net"] / df["total_inflation"]
-        df["income_net_cor"] = df["income_net"] / df["total_inflation"]
-        df["assets_cor"] = df["assets"] / df["total_inflation"]
-
-        dfs += [df]
-        # TODO implement me stats += [manager.get_stats()]
-
-    df = pd.concat(dfs)
+    else:
+        # the manager is built once, every run starts from a restored snapshot
+        manager = fup.core.manager.Manager(config=config,
+                                           module_blueprints=module_blueprints,
+                                           profile_blueprint=profile_blueprint,
+                                           current_account_name=CURRENT_ACCOUNT_NAME,
+                                           seed=seed, first_run=first_run)
+        manager.profiler = profiler
+        if tape is not None:
+            manager.random.use_tape(tape)
+        snapshot = manager.snapshot()
+        result = SimulationResult(schema=manager.schema, runs=runs, years=n_years, first_run=first_run)
+        for i in range(runs):
+            manager.restore(snapshot, first_run=first_run + i)
+            manager.write_results(result=result, runs=i)
+            for i_year in range(n_years):
+                manager.next_year()
+            # TODO implement me stats += [manager.get_stats()]
+    result.profiler = profiler
+    return result
+
+
+_worker = dict()
+
+
+def _init_worker(config, batch, profile, tape):
+    # blueprints are sorted once per worker process, not once per chunk
+    _worker["config"] = config
+    _worker["batch"] = batch
+    _worker["profile"] = profile
+    _worker["tape"] = tape
+    _worker["module_blueprints"] = get_sorted_module_blueprints(config)
+    _worker["profile_blueprint"] = get_blueprint(config=config["profile"], root_module=fup.profiles)
+
+
+def _simulate_chunk(chunk):
+    first_run, runs, seed = chunk
+    return simulate_runs(config=_worker["config"],
+                         module_blueprints=_worker["module_blueprints"],
+                         profile_blueprint=_worker["profile_blueprint"],
+                         first_run=first_run, runs=runs, seed=seed, batch=_worker["batch"],
+                         profile=_worker["profile"], tape=_worker["tape"])
+
+
+def simulate_chunks(config, chunks, batch=False, workers=None, profile=False, tape=None):
+    """
+    Yield the SimulationResult of each chunk (first_run, runs, seed) in order, in a process pool if workers > 1.
+    """
+    if workers is not None and workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                    initargs=(config, batch, profile, tape)) as executor:
+            # only a few chunks ahead, little is wasted if the consumer stops early
+            chunks = iter(chunks)
+            pending = collections.deque(executor.submit(_simulate_chunk, chunk)
+                                        for chunk in itertools.islice(chunks, 2 * workers))
+            try:
+                while pending:
+                    result = pending.popleft().result()
+                    pending.extend(executor.submit(_simulate_chunk, chunk) for chunk in itertools.islice(chunks, 1))
+                    yield result
+            finally:
+                for future in pending:
+                    future.cancel()
+    else:
+        sorted_module_blueprints = get_sorted_module_blueprints(config)
+        profile_blueprint = get_blueprint(config=config["profile"], root_module=fup.profiles)
+        for first_run, runs, seed in chunks:
+            yield simulate_runs(config=config, module_blueprints=sorted_module_blueprints,
+                                profile_blueprint=profile_blueprint, first_run=first_run, runs=runs, seed=seed,
+                                batch=batch, profile=profile, tape=tape)
+
+
+def run_simulations(config, runs=100, debug=False, batch=False, workers=None, chunk_size=None, as_dataframe=True,
+                    aggregator=None, keep_results=True, store=None, checkpoint=None, profiler=None, until=None,
+                    tape=None):
+    """
+    Simulate the config runs times.
+    With batch=True the runs are simulated at once as vectors by a single manager.
+    With workers > 1 chunks of chunk_size runs are simulated in a process pool.
+    Every run draws its random numbers from streams seeded by the simulation seed of the config and its run number,
+    the result neither depends on the number of workers nor on batch.
+    Each finished chunk is fed to the aggregator (e.g. a QuantileAggregator), with keep_results=False
+    the runs are not kept and the memory stays constant.
+    Each finished chunk is appended to the store (a ResultStore on disk) if given, written in the background.
+    Streaming to an aggregator or a store, or with keep_results=False, the chunks have at most STREAMING_CHUNK_SIZE
+    runs by default.
+    With checkpoint (a directory) every finished chunk is saved there, together with the job (config, runs,
+    chunk size and seed). Running the same job with the same checkpoint again continues after the saved chunks,
+    with the same result as without interruption.
+    With a profiler (a ModuleProfiler) the modules are timed, added up over all runs simulated (not loaded from
+    the checkpoint), see profiler.to_dataframe() and profiler.to_collapsed_stacks().
+    With until (a function without arguments, e.g. ConvergenceMonitor.converged) the simulation stops after the
+    first chunk for which it returns True, runs is the budget then.
+    With a tape (DriverTape, see generate_driver_tape) the numbers of the drivers are replayed from it instead of
+    drawn, the seed of the tape is used if the config has none.
+    Returns the long format DataFrame of all runs, or the SimulationResult if as_dataframe=False.
+    """
+    time_start = time.time()
+
+    checkpoint_store = None
+    job = None
+    if checkpoint is not None:
+        checkpoint_store = ResultStore(path=checkpoint)
+        job = checkpoint_store.metadata.get("job")
+
+    seed = config["simulation"].get("seed")
+    if seed is None and tape is not None:
+        seed = tape.settings["seed"]
+    if seed is None:
+        seed = job["seed"] if job is not None else np.random.SeedSequence().entropy
+
+    if chunk_size is None:
+        if job is not None:
+            chunk_size = job["chunk_size"]
+        else:
+            chunk_size = -(-runs // workers) if workers is not None and workers > 1 else runs
+            if aggregator is not None or store is not None or not keep_results:
+                chunk_size = min(chunk_size, STREAMING_CHUNK_SIZE)
+    chunks = [(first_run, min(chunk_size, runs - first_run), seed) for first_run in range(0, runs, chunk_size)]
+
+    saved_chunks = set()
+    if checkpoint_store is not None:
+        new_job = get_checkpoint_job(config=config, runs=runs, chunk_size=chunk_size, seed=seed)
+        if job is not None and job != new_job:
+            raise ValueError(f"checkpoint {checkpoint} belongs to another job")
+        checkpoint_store.metadata["job"] = new_job
+        saved_chunks = set(checkpoint_store.shards)
+
+    results = []
+    simulated_runs = 0
+    simulated = simulate_chunks(config=config, chunks=[chunk for chunk in chunks if chunk[:2] not in saved_chunks],
+                                batch=batch, workers=workers, profile=profiler is not None, tape=tape)
+    try:
+        for first_run, chunk_runs, _ in chunks:
+            if (first_run, chunk_runs) in saved_chunks:
+                result = checkpoint_store.load_result(first_run)
+            else:
+                result = next(simulated)
+                if profiler is not None:
+                    profiler.merge(result.profiler)
+                if checkpoint_store is not None:
+                    checkpoint_store.append(result)
+            simulated_runs += result.runs
+            if aggregator is not None:
+                aggregator.update(result)
+            if store is not None:
+                store.append(result)
+            if keep_results:
+                results += [result]
+            if until is not None and until():
+                break
+    finally:
+        simulated.close()
+        # everything finished is saved, also if the job is interrupted
+        if checkpoint_store is not None:
+            checkpoint_store.flush()
+        if store is not None:
+            store.flush()
+
+    df = None
+    if keep_results:
+        result = SimulationResult.concat(results)
+        df = result.to_dataframe() if as_dataframe else result
+    stats = []
     df_stats = pd.DataFrame(stats)
 
     if debug:
-        print(f"Finished {runs} runs in {round(time.time() - time_start, 2)}s")
+        print(f"Finished {simulated_runs} runs in {round(time.time() - time_start, 2)}s")
 
     return df, df_stats
+
+
+def get_checkpoint_job(config, runs, chunk_size, seed):
+    # as loaded from the json manifest of a checkpoint
+    return json.loads(json.dumps(dict(config=config, runs=runs, chunk_size=chunk_size, seed=seed)))
+
+
+def generate_driver_tape(config, runs, path=None, seed=None):
+    """
+    Draw the numbers of the drivers of the config (inflation, investment returns, job, events) for runs runs into
+    a DriverTape, in memory or memory-mapped in the directory path, to be replayed by run_simulations(tape=...).
+    The seed of the config is used, or seed, or a new one.
+    """
+    if seed is None:
+        seed = config["simulation"].get("seed")
+    manager = Manager(config=config,
+                      module_blueprints=get_sorted_module_blueprints(config),
+                      profile_blueprint=get_blueprint(config=config["profile"], root_module=fup.profiles),
+                      current_account_name=CURRENT_ACCOUNT_NAME, seed=seed)
+    return DriverTape.record(streams=manager.random, runs=runs, path=path)
+
+
+def get_scenario_summary(result):
+    """
+    Default summary of the runs of a scenario, inflation corrected.
+    Runs are weighted by their likelihood ratio, if importance sampled.
+    """
+    assets = result["assets_cor"]
+    weights = result["likelihood_ratio"][:, -1] if "likelihood_ratio" in result.schema else None
+    return dict(bankruptcy_rate=np.average(assets.min(axis=1) < 0, weights=weights),
+                mean_savings_at_end=np.average(assets[:, -1], weights=weights),
+                mean_expenses=np.average(result["expenses_net_cor"].mean(axis=1), weights=weights))
+
+
+def get_grid_scenarios(grid):
+    """
+    Scenarios of the Cartesian product of a grid {config path (tuple of keys): list of values}.
+    """
+    scenarios = []
+    for values in itertools.product(*grid.values()):
+        overrides = dict()
+        for path, value in zip(grid, values):
+            overwrite_config(overrides, _get_nested_dict(path, value))
+        name = ", ".join(f"{path[-1]}={value}" for path, value in zip(grid, values))
+        scenarios += [dict(name=name, config=overrides, parameters=dict(zip([path[-1] for path in grid], values)))]
+    return scenarios
+
+
+def _get_nested_dict(path, value):
+    for key in reversed(path):
+        value = {key: value}
+    return value
+
+
+def _run_scenario(task):
+    config, runs, batch, summary, tape = task
+    result, _ = run_simulations(config=config, runs=runs, batch=batch, as_dataframe=False, tape=tape)
+    return summary(result)
+
+
+def run_sweep(config, grid=None, scenarios=None, runs=100, workers=None, batch=False, summary=get_scenario_summary,
+              debug=False, checkpoint=None, tape=None):
+    """
+    Simulate scenarios of the config and summarise each of them in one row.
+    grid: {config path (tuple of keys): list of values}, simulates the Cartesian product
+    scenarios: explicit list of dict(name=..., config=overrides of the config), instead of or in addition to grid
+    All scenarios use the same random numbers (the seed of the config or one drawn for the sweep), the differences
+    between scenarios are not blurred by different random numbers.
+    Scenarios are simulated in a process pool with workers > 1, each process sorts the blueprints once per
+    module layout. summary(result) returns the dict of one row, it has to be picklable for workers > 1.
+    With checkpoint (a json file) the summary of every finished scenario is saved, running the same sweep with the
+    same checkpoint again only simulates the missing scenarios.
+    With tape=True the numbers of the drivers are drawn once into a DriverTape shared by all scenarios, instead of
+    by every scenario again, or tape is a DriverTape of generate_driver_tape (e.g. memory-mapped on disk).
+    """
+    time_start = time.time()
+    scenarios = list(scenarios or []) + (get_grid_scenarios(grid) if grid else [])
+
+    progress = dict(job=None, summaries=dict())
+    if checkpoint is not None and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            progress = json.load(f)
+
+    seed = config["simulation"].get("seed")
+    if seed is None and isinstance(tape, DriverTape):
+        seed = tape.settings["seed"]
+    if seed is None:
+        seed = progress["job"]["seed"] if progress["job"] is not None else np.random.SeedSequence().entropy
+    if tape is True:
+        tape = generate_driver_tape(config, runs=runs, seed=seed)
+
+    tasks = []
+    for scenario in scenarios:
+        scenario_config = copy.deepcopy(config)
+        overwrite_config(scenario_config, scenario["config"])
+        scenario_config["simulation"]["seed"] = seed
+        tasks += [(scenario_config, runs, batch, summary, tape)]
+
+    job = json.loads(json.dumps(dict(configs=[task[0] for task in tasks], runs=runs, seed=seed)))
+    if progress["job"] is not None and progress["job"] != job:
+        raise ValueError(f"checkpoint {checkpoint} belongs to another sweep")
+    progress["job"] = job
+    summaries = {int(i): scenario_summary for i, scenario_summary in progress["summaries"].items()}
+
+    def save(i, scenario_summary):
+        summaries[i] = scenario_summary
+        if checkpoint is not None:
+            progress["summaries"] = summaries
+            with open(checkpoint + ".tmp", "w") as f:
+                json.dump(progress, f, default=lambda value: value.item())
+            os.replace(checkpoint + ".tmp", checkpoint)
+
+    missing = [i for i in range(len(tasks)) if i not in summaries]
+    if workers is not None and workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_run_scenario, tasks[i]): i for i in missing}
+            for future in concurrent.futures.as_completed(futures):
+                save(futures[future], future.result())
+    else:
+        for i in missing:
+            save(i, _run_scenario(tasks[i]))
+    summaries = [summaries[i] for i in range(len(tasks))]
+
+    rows = []
+    for scenario, scenario_summary in zip(scenarios, summaries):
+        rows += [dict(name=scenario.get("name"), **scenario.get("parameters", dict()), runs=runs, **scenario_summary)]
+
+    if debug:
+        print(f"Finished {len(scenarios)} scenarios of {runs} runs in {round(time.time() - time_start, 2)}s")
+
+    return pd.DataFrame(rows)
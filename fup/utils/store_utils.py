@@ -0,0 +1,198 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+import pandas as pd
+
+from fup.core.results import ColumnSchema, SimulationResult
+from fup.utils.quantile_utils import get_weighted_percentiles
+
+schema_dtypes = {"int": int, "float": float, "object": object}
+
+
+class ResultStore:
+    """
+    On disk columnar store of simulation results: one .npy file (runs x years) per column and chunk of runs.
+    Chunks are appended (e.g. by run_simulations(store=...)) and written by a background thread,
+    reading memory maps the files, only the requested runs and years are loaded. create_plot draws fan charts of it.
+
+    path/manifest.json lists the columns, years and the written chunks, a chunk is only listed once all its
+    files are written. It also keeps the schema of the results, to load chunks as SimulationResult again,
+    and free metadata (e.g. the job of a checkpoint).
+    """
+    default_percentiles = (5, 25, 50, 75, 95)
+
+    def __init__(self, path, max_pending=2):
+        self.path = path
+        self.columns = None  # column -> dtype
+        self.schema = None  # (column, dtype) of the ColumnSchema
+        self.years = None
+        self.shards = []  # (first_run, runs), sorted by first_run
+        self._pending_shards = []  # (first_run, runs) appended but not yet written
+        self.metadata = dict()
+        manifest_path = os.path.join(path, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            self.columns = manifest["columns"]
+            self.schema = [tuple(column) for column in manifest["schema"]]
+            self.years = np.array(manifest["years"])
+            self.shards = [tuple(shard) for shard in manifest["shards"]]
+            self.metadata = manifest["metadata"]
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._error = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    @property
+    def runs(self):
+        return sum(runs for first_run, runs in self.shards)
+
+    @property
+    def run_numbers(self):
+        return np.concatenate([np.arange(first_run, first_run + runs) for first_run, runs in self.shards] or [[]])
+
+    def append(self, result):
+        """
+        Queue the SimulationResult of a chunk of runs for writing, blocks while max_pending chunks are waiting.
+        Raises a ValueError if runs of the chunk are already stored (or queued).
+        """
+        self._raise_error()
+        last_run = result.first_run + result.runs
+        with self._lock:
+            if any(first_run < last_run and result.first_run < first_run + runs
+                   for first_run, runs in self.shards + self._pending_shards):
+                raise ValueError(f"runs {result.first_run} to {last_run - 1} are already in the store {self.path}")
+            self._pending_shards += [(result.first_run, result.runs)]
+        if self.columns is None:
+            self.columns = {column: "str" if result[column].dtype == object else "float"
+                            for column in result.columns}
+            self.schema = [(column, dtype.__name__) for column, (dtype, index) in result.schema.columns.items()]
+            self.years = result.years
+        assert list(result.years) == list(self.years)
+
+        arrays = dict()
+        for column, dtype in self.columns.items():
+            values = result[column]
+            if dtype == "str":
+                values = np.where(values == None, "", values).astype(str)  # noqa: E711
+            arrays[column] = values
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_shards, daemon=True)
+            self._thread.start()
+        self._queue.put((result.first_run, result.runs, arrays))
+
+    def flush(self):
+        """
+        Wait until all queued chunks are written.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write_shards(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue
+            try:
+                first_run, runs, arrays = item
+                shard_path = self.get_shard_path(first_run)
+                os.makedirs(shard_path, exist_ok=True)
+                for column, values in arrays.items():
+                    np.save(os.path.join(shard_path, column + ".npy"), values)
+                with self._lock:
+                    self.shards = sorted(self.shards + [(first_run, runs)])
+                    self._pending_shards.remove((first_run, runs))
+                    self._write_manifest()
+            except Exception as error:
+                self._error = error
+
+    def _write_manifest(self):
+        manifest = dict(columns=self.columns, schema=[list(column) for column in self.schema],
+                        years=[int(year) for year in self.years], shards=[list(shard) for shard in self.shards],
+                        metadata=self.metadata)
+        tmp_path = os.path.join(self.path, "manifest.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(self.path, "manifest.json"))
+
+    def get_shard_path(self, first_run):
+        return os.path.join(self.path, f"runs_{first_run:09d}")
+
+    def get(self, column, runs=None, years=None):
+        """
+        (runs, years) array of column, runs: slice or indices of the stored runs (in run order), years: slice or
+        indices of the years. Only the files of the shards containing the runs are read.
+        """
+        indices = np.arange(self.runs)[slice(None) if runs is None else runs]
+        years = slice(None) if years is None else years
+        parts = []
+        position = 0
+        for first_run, shard_runs in self.shards:
+            shard_indices = indices[(indices >= position) & (indices < position + shard_runs)] - position
+            if len(shard_indices):
+                values = np.load(os.path.join(self.get_shard_path(first_run), column + ".npy"), mmap_mode="r")
+                parts += [np.asarray(values[:, years][shard_indices])]
+            position += shard_runs
+        if not parts:
+            return np.empty((0, len(self.years[years])))
+        return np.concatenate(parts)
+
+    def load_result(self, first_run):
+        """
+        SimulationResult of the chunk starting at first_run, as it was appended.
+        """
+        runs = dict(self.shards)[first_run]
+        schema = ColumnSchema()
+        for column, dtype in self.schema:
+            schema.declare(column, dtype=schema_dtypes[dtype])
+        result = SimulationResult(schema=schema, runs=runs, years=len(self.years), first_run=first_run)
+        shard_path = self.get_shard_path(first_run)
+        for column, (dtype, index) in schema.columns.items():
+            values = np.load(os.path.join(shard_path, column + ".npy"))
+            if dtype is object:
+                result.objects[:, :, index] = np.where(values == "", None, values.astype(object))
+            else:
+                result.values[:, :, index] = values
+        return result
+
+    def __getitem__(self, column):
+        return self.get(column)
+
+    def percentiles(self, column, percentiles=default_percentiles, runs=None, year_block=8):
+        """
+        DataFrame with one row per year and one column per percentile, like QuantileAggregator.percentiles,
+        only year_block years of the runs are in memory at once. Runs are weighted by their likelihood ratio,
+        if importance sampled.
+        """
+        out = []
+        for first_year in range(0, len(self.years), year_block):
+            years = slice(first_year, first_year + year_block)
+            values = self.get(column, runs=runs, years=years)
+            if "likelihood_ratio" in self.columns:
+                out += [get_weighted_percentiles(values, self.get("likelihood_ratio", runs=runs, years=years),
+                                                 percentiles)]
+            else:
+                out += [np.percentile(values, percentiles, axis=0).T]
+        df = pd.DataFrame(np.concatenate(out), columns=[f"percentile_{p}" for p in percentiles])
+        df.insert(0, "year", self.years)
+        return df
@@ -19,6 +19,7 @@ setup(
     long_description=readme,
     packages=['fup'],
     include_package_data=True,
+    package_data={'fup': ['modules/events/*.yaml']},
     zip_safe=False,
     platforms='any',
     python_requires='>=3.9',
@@ -34,6 +35,9 @@ setup(
             'flake8==3.9.2',
             'pytest==6.2.4',
             'pytest-cov==2.12.1'
+        ],
+        'qmc': [
+            'scipy>=1.7'
         ]
     },
     # entry_points={
@@ -6,8 +6,7 @@ from fup.core.functions import get_blueprint
 import fup.profiles
 
 
-@pytest.fixture(scope="function")
-def default_config():
+def get_default_config():
     return {
         "simulation": {
             "start_year": 2000,
@@ -22,8 +21,9 @@ def default_config():
     }
 
 
-@pytest.fixture(scope="function")
-def modules_config(default_config):
+def get_modules_config():
+    # also used by the benchmarks
+    default_config = get_default_config()
     default_config["modules"] = {
         "Job": {
             "start_income": 42000,
@@ -77,6 +77,16 @@ def modules_config(default_config):
     return default_config
 
 
+@pytest.fixture(scope="function")
+def default_config():
+    return get_default_config()
+
+
+@pytest.fixture(scope="function")
+def modules_config():
+    return get_modules_config()
+
+
 @pytest.fixture(scope="function")
 def default_profile_blueprint(default_config):
     return get_blueprint(config=default_config["profile"], root_module=fup.profiles)
@@ -1,4 +1,6 @@
-from fup.core.functions import get_full_class_name, get_all_modules, get_module_blueprints
+import pytest
+import fup.core.functions
+from fup.core.functions import get_full_class_name, get_all_modules, get_module_blueprints, get_class
 
 
 def test_get_full_class_name():
@@ -49,3 +51,31 @@ def test_get_module_config_list():
     assert module_config_list[2].build_class == fup.modules.main.investing.Investing
     assert module_config_list[2].build_config == {"assets_ratios": {"test": 0.4}}
     assert module_config_list[2].run_end_of_year is True
+
+
+def test_get_class(monkeypatch):
+    import fup.modules
+    import fup.profiles
+    assert get_class(class_name="main.work.Job", root_module=fup.modules) == fup.modules.main.work.Job
+    assert get_class(class_name="profiles.profiles.FullInvestment", root_module=fup.profiles) == \
+        fup.profiles.profiles.FullInvestment
+    with pytest.raises(KeyError):
+        get_class(class_name="profiles.profiles.FullInvestment", root_module=fup.modules)
+
+    class EntryPoint:
+        name = "plugin.Job"
+        loaded = 0
+
+        def load(self):
+            self.loaded += 1
+            return fup.modules.main.work.Job
+
+    entry_point = EntryPoint()
+    monkeypatch.setattr(fup.core.functions, "get_entry_points", lambda group: [entry_point] if group == "fup.modules" else [])
+    monkeypatch.setattr(fup.core.functions, "_plugin_classes", dict())
+    assert entry_point.loaded == 0
+    assert get_class(class_name="plugin.Job", root_module=fup.modules) == fup.modules.main.work.Job
+    assert get_class(class_name="plugin.Job", root_module=fup.modules) == fup.modules.main.work.Job
+    assert entry_point.loaded == 1
+    with pytest.raises(KeyError):
+        get_class(class_name="plugin.Job", root_module=fup.profiles)
@@ -1,6 +1,12 @@
+import copy
+
+import numpy as np
+import pytest
+
 from fup.core.config import BluePrint
 from fup.core.manager import Manager
-from fup.core.module import ChangeModule, AssetModule
+from fup.core.module import ChangeModule, AssetModule, EventModule
+from fup.utils.simulation_utils import get_sorted_module_names
 
 
 class Change1(ChangeModule):
@@ -10,33 +16,50 @@ class Change1(ChangeModule):
 
 
 class Change2(ChangeModule):
+    reads = {"test1": ["value1"]}
+
     def next_year(self):
         value1 = self.get_prop("test1", "value1")
         self.expenses = value1
 
 
 class Change3(ChangeModule):
+    writes = {"test1": ["value1"]}
+
     def next_year(self):
         multiply_value1 = self.get_prop_multiplier("test1", "value1")
         multiply_value1(2)
         self.income = 100
 
 
+class Change4(Change1):
+    reads = {"test2": ["expenses"]}
+
+
+class CountedEvent(EventModule):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = 0
+
+    def next_year(self):
+        self.calls += 1
+        if self.crisis_year == 1:
+            self.active = False
+
+
 def test_manager_dependency(default_config, default_profile_blueprint):
     module_blueprints = [
         BluePrint(name="test3", build_config={}, build_class=Change3),
         BluePrint(name="test1", build_config={"value1": 1}, build_class=Change1),
         BluePrint(name="test2", build_config={"value2": 2}, build_class=Change2),
-        BluePrint(name="CurrentAccount", build_config={"start_money_value": 1000}, build_class=AssetModule),
+        BluePrint(name="CurrentAccount", build_config={"start_money_value": 1000}, build_class=AssetModule,
+                  run_end_of_year=True),
     ]
-    manager = Manager(config=default_config,
-                      module_blueprints=module_blueprints,
-                      profile_blueprint=default_profile_blueprint,
-                      current_account_name="CurrentAccount")
-    # dependency check
-    manager.dependency_check()
-    assert manager.get_module("test2").depends_on_modules == {'test1'}
-    assert manager.get_module("test3").modifies_modules == {'test1'}
+    # declared reads and writes, without building the modules
+    assert get_sorted_module_names(module_blueprints[::-1]) == ["test3", "test1", "test2", "CurrentAccount"]
+    module_blueprints[1].build_class = Change4  # test1 and test2 read each other
+    with pytest.raises(Exception, match="Dependency loop"):
+        get_sorted_module_names(module_blueprints)
 
 
 def test_manager(default_config, default_profile_blueprint):
@@ -67,3 +90,65 @@ def test_manager(default_config, default_profile_blueprint):
     assert df_row["year"] == 2002
     assert df_row["income"] == 100
     assert df_row["expenses"] == 7
+
+
+def test_manager_snapshot(default_config, default_profile_blueprint):
+    module_blueprints = [
+        BluePrint(name="test3", build_config={}, build_class=Change3),
+        BluePrint(name="test1", build_config={"value1": 1, "values": [1, 2]}, build_class=Change1),
+        BluePrint(name="CurrentAccount", build_config={"start_money_value": 1000}, build_class=AssetModule),
+    ]
+    manager = Manager(config=default_config,
+                      module_blueprints=module_blueprints,
+                      profile_blueprint=default_profile_blueprint,
+                      current_account_name="CurrentAccount", seed=42)
+    snapshot = manager.snapshot()
+    modules = list(manager.modules.values())
+    for i in range(2):
+        manager.next_year()
+        manager.get_module("test1").values.append(3)
+        assert manager.df_row["expenses"] == 3
+        assert manager.random.uniform("test") == Manager(config=default_config,
+                                                         profile_blueprint=default_profile_blueprint,
+                                                         current_account_name="CurrentAccount",
+                                                         seed=42, first_run=i).random.uniform("test")
+        manager.restore(snapshot, first_run=i + 1)
+        assert manager.year == 2000
+        assert manager.total_assets == 1000
+        assert manager.get_module("test1").values == [1, 2]
+        assert list(manager.modules.values()) == modules
+        assert manager.get_module("test1").manager is manager
+
+
+def test_manager_event_scheduler(default_config, default_profile_blueprint):
+    module_blueprints = [
+        BluePrint(name="dormant", build_config={"start_year": 1990}, build_class=CountedEvent),
+        BluePrint(name="crisis", build_config={"start_year": 2003}, build_class=CountedEvent),
+        BluePrint(name="CurrentAccount", build_config={"start_money_value": 1000}, build_class=AssetModule),
+    ]
+    manager = Manager(config=default_config, module_blueprints=module_blueprints,
+                      profile_blueprint=default_profile_blueprint, current_account_name="CurrentAccount")
+    events = []
+    for i in range(10):
+        manager.next_year()
+        events += [manager.df_row.get("event")]
+    # only the years the crisis is active, the dormant event is not called at all
+    assert events == [None, None, "crisis", None, None, None, None, None, None, None]
+    assert manager.get_module("crisis").calls == 2
+    assert manager.get_module("dormant").calls == 0
+    assert not manager.awake_events and not any(manager.event_calendar.values())
+
+    # start years of a yearly probability are drawn from the geometric distribution of the waiting time
+    config = copy.deepcopy(default_config)
+    config["simulation"]["random"] = True
+    module_blueprints = [BluePrint(name="crisis", build_config={"probability": 0.2}, build_class=CountedEvent)]
+    manager = Manager(config=config, module_blueprints=module_blueprints, profile_blueprint=default_profile_blueprint,
+                      current_account_name="CurrentAccount", runs=10000, seed=42)
+    first_years = np.full(10000, 0)
+    for i in range(20):
+        manager.next_year()
+        started = (manager.df_row.get("event") == "crisis") & (first_years == 0)
+        first_years[started] = manager.year
+    assert np.mean(first_years == 2001) == pytest.approx(0.2, abs=0.015)
+    assert np.mean(first_years == 2002) == pytest.approx(0.8 * 0.2, abs=0.015)
+    assert np.mean(first_years == 0) == pytest.approx(0.8 ** 20, abs=0.01)
@@ -1,4 +1,5 @@
 import pytest
+import numpy as np
 from fup.core.config import BluePrint
 from fup.core.manager import Manager
 from fup.core.module import Module, AssetModule, ChangeModule
@@ -31,6 +32,56 @@ def test_module(default_config, default_profile_blueprint):
     assert info["info"] == ""
 
 
+class Linked(Module):
+    reads = {"test2": ["test_parm"]}
+    writes = {"test2": ["test_parm"]}
+
+    def link(self):
+        self.get_test_parm = self.get_prop_getter("test2", "test_parm")
+        self.multiply_test_parm = self.get_prop_multiplier("test2", "test_parm")
+
+
+def test_module_link(default_config, default_profile_blueprint):
+    module_blueprints = [BluePrint(name="test", build_config={}, build_class=Linked),
+                         BluePrint(name="test2", build_config={"test_parm": 123}, build_class=Module)]
+    manager = Manager(config=default_config,
+                      current_account_name="CurrentAccount",
+                      profile_blueprint=default_profile_blueprint,
+                      module_blueprints=module_blueprints)
+    module = manager.get_module("test")
+    assert module.depends_on_modules == {"test2"}
+    assert module.modifies_modules == {"test2"}
+    assert module.get_test_parm() == 123
+    module.multiply_test_parm(2)
+    assert manager.get_module("test2").test_parm == 246
+
+    # modules added later are looked up on access
+    manager = Manager(config=default_config,
+                      current_account_name="CurrentAccount",
+                      profile_blueprint=default_profile_blueprint,
+                      module_blueprints=module_blueprints[:1])
+    module = manager.get_module("test")
+    manager.add_module(module_blueprints[1])
+    assert module.get_test_parm() == 123
+    module.run_mask = np.array([True, False])
+    module.multiply_test_parm(2)
+    assert manager.get_module("test2").test_parm.tolist() == [246, 123]
+
+
+class Undeclared(Linked):
+    writes = {}
+
+
+def test_module_undeclared_link(default_config, default_profile_blueprint):
+    module_blueprints = [BluePrint(name="test", build_config={}, build_class=Undeclared),
+                         BluePrint(name="test2", build_config={"test_parm": 123}, build_class=Module)]
+    with pytest.raises(AssertionError, match="test modifies undeclared modules"):
+        Manager(config=default_config,
+                current_account_name="CurrentAccount",
+                profile_blueprint=default_profile_blueprint,
+                module_blueprints=module_blueprints)
+
+
 class Change1(ChangeModule):
     def next_year(self):
         self.income = 1000
@@ -118,3 +169,26 @@ def test_assets_module(default_config, default_profile_blueprint):
     assert info["class"] == "core.module.AssetModule"
     assert info["info"] == ""
     assert info["value"] == 14400
+
+
+def test_assets_module_batch(default_config, default_profile_blueprint):
+    build_config = {"start_money_value": 1000, "gains_tax": 0.25, "exchange_fee": 0.1}
+    moneys = [500, -500, 0]
+    manager = Manager(config=default_config,
+                      profile_blueprint=default_profile_blueprint,
+                      current_account_name="CurrentAccount",
+                      runs=len(moneys))
+    manager.add_module(BluePrint(name="test", build_config=build_config, build_class=AssetModule))
+    amod = manager.get_module("test")
+    amod.asset_value *= 2
+    returned = amod.change(money=np.array(moneys, dtype=float))
+
+    for i, money in enumerate(moneys):
+        single_manager = Manager(config=default_config,
+                                 profile_blueprint=default_profile_blueprint,
+                                 current_account_name="CurrentAccount")
+        single_manager.add_module(BluePrint(name="test", build_config=build_config, build_class=AssetModule))
+        single_amod = single_manager.get_module("test")
+        single_amod.asset_value *= 2
+        assert returned[i] == pytest.approx(single_amod.change(money=money))
+        assert amod.money_value[i] == pytest.approx(single_amod.money_value)
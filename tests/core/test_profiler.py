@@ -0,0 +1,60 @@
+import pytest
+
+from fup.core.config import BluePrint
+from fup.core.manager import Manager
+from fup.core.module import ChangeModule, AssetModule
+from fup.core.profiler import ModuleProfiler
+from fup.utils.simulation_utils import run_simulations
+
+
+class Lookup(ChangeModule):
+    def next_year(self):
+        self.expenses = self.get_prop("CurrentAccount", "money_value") * 0.01
+
+
+class Linked(ChangeModule):
+    reads = {"CurrentAccount": ["money_value"]}
+
+    def link(self):
+        self.get_money_value = self.get_prop_getter("CurrentAccount", "money_value")
+
+    def next_year(self):
+        self.expenses = (self.get_money_value() + self.get_money_value()) * 0.01
+
+
+def test_module_profiler(default_config, default_profile_blueprint):
+    module_blueprints = [
+        BluePrint(name="lookup", build_config={}, build_class=Lookup),
+        BluePrint(name="linked", build_config={}, build_class=Linked),
+        BluePrint(name="CurrentAccount", build_config={"start_money_value": 1000}, build_class=AssetModule),
+    ]
+    manager = Manager(config=default_config,
+                      module_blueprints=module_blueprints,
+                      profile_blueprint=default_profile_blueprint,
+                      current_account_name="CurrentAccount")
+    manager.profiler = ModuleProfiler()
+    for i in range(3):
+        manager.next_year()
+
+    df = manager.profiler.to_dataframe()
+    assert set(df["module"]) == {"lookup", "linked", "CurrentAccount", "profile"}
+    assert df["calls"].tolist() == [3, 3, 3, 3]
+    assert df.set_index("module")["lookups"].to_dict() == {"lookup": 3, "linked": 6, "CurrentAccount": 0,
+                                                           "profile": 0}
+    assert df["share"].sum() == pytest.approx(1)
+    stacks = manager.profiler.to_collapsed_stacks().splitlines()
+    stack, microseconds = stacks[0].split(" ")
+    assert stack.startswith("Manager.next_year;") and stack.endswith("test_profiler.Lookup:lookup")
+    assert int(microseconds) >= 0
+
+
+def test_run_simulations_profiler(modules_config):
+    years = modules_config["simulation"]["end_year"] - modules_config["simulation"]["start_year"]
+    for kwargs in [dict(), dict(batch=True), dict(workers=2)]:
+        profiler = ModuleProfiler()
+        run_simulations(config=modules_config, runs=4, profiler=profiler, **kwargs)
+        df = profiler.to_dataframe().set_index("module")
+        calls = 4 * years if not kwargs.get("batch") else years
+        assert df.loc["Job", "calls"] == calls
+        assert df.loc["main.taxes.Taxes", "class"] == "main.taxes.Taxes"
+        assert len(df) == len(modules_config["modules"]) + 1
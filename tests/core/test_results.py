@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from fup.core.results import ColumnSchema, SimulationResult
+
+
+def get_result(runs=2, years=3, first_run=0):
+    schema = ColumnSchema()
+    schema.declare("year", dtype=int)
+    schema.declare("assets")
+    schema.declare("assets")
+    schema.declare("event", dtype=object)
+    return SimulationResult(schema=schema, runs=runs, years=years, first_run=first_run)
+
+
+def test_result_rows():
+    result = get_result()
+    assert result.values.shape == (2, 3, 2)
+    assert result.objects.shape == (2, 3, 1)
+
+    row = result.row(runs=1)
+    row.year_index = 2
+    row["year"] = 2002
+    row["assets"] = row.get("assets", 0) + 100
+    row["assets"] = row.get("assets", 0) + 100
+    assert "event" not in row
+    row["event"] = "crisis"
+    assert "event" in row
+    with pytest.raises(KeyError):
+        row["unknown"] = 1
+
+    batch_row = result.row(runs=slice(None))
+    batch_row["assets"] = np.array([1., 2.])
+    assert result["assets"][:, 0] == pytest.approx([1., 2.])
+    assert result["assets"][1, 2] == 200
+    assert result["event"][1, 2] == "crisis"
+
+
+def test_result_dataframe():
+    result = SimulationResult.concat([get_result(runs=2), get_result(runs=1, first_run=2)])
+    result.row(runs=slice(None))["assets"] = np.array([1., 2., 3.])
+    df = result.to_dataframe()
+    assert len(df) == 3 * 3
+    assert list(df["run"].unique()) == [0, 1, 2]
+    assert df.query("run == 2")["assets"].tolist() == [3, 0, 0]
+    assert df["event"].isnull().all()
+    # no derived columns without tax and inflation
+    assert "assets_cor" not in df.columns
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from fup.core.streams import RandomStreams, get_brownian_bridge_order
+
+
+def test_random_streams():
+    streams = RandomStreams(seed=42, runs=10)
+    batch_normals = [streams.normal("inflation") for i in range(300)]
+    batch_uniforms = [streams.uniform("job") for i in range(3)]
+
+    # run 7 of the batch regenerated on its own
+    single = RandomStreams(seed=42, first_run=7)
+    assert [single.normal("inflation") for i in range(300)] == [normals[7] for normals in batch_normals]
+    assert [single.uniform("job") for i in range(3)] == [uniforms[7] for uniforms in batch_uniforms]
+
+    # streams of other modules don't shift the stream
+    single = RandomStreams(seed=42, first_run=7)
+    single.uniform("job")
+    assert single.normal("inflation", mu=1, sigma=2) == pytest.approx(1 + 2 * batch_normals[0][7])
+
+    # runs and seeds are independent
+    assert len(set(batch_normals[0])) == 10
+    assert RandomStreams(seed=43, first_run=7).normal("inflation") != batch_normals[0][7]
+
+
+def test_random_streams_variance_reduction():
+    streams = RandomStreams(seed=42, runs=4, antithetic=True, control_variates=True)
+    normals = [streams.normal("inflation") for i in range(300)]
+    uniforms = [streams.uniform("job") for i in range(3)]
+    for values in normals:
+        assert values[1] == -values[0] and values[3] == -values[2] and values[0] != values[2]
+    assert len(set(uniforms[0])) == 4  # only the normal numbers are mirrored
+
+    # pairs are formed by the run numbers, independent of the batch
+    single = RandomStreams(seed=42, first_run=3, antithetic=True, control_variates=True)
+    assert [single.normal("inflation") for i in range(300)] == [values[3] for values in normals]
+    assert single.get_control("inflation") == pytest.approx(sum(values[3] for values in normals) / 300 ** 0.5)
+    assert single.get_control("job") == 0
+    assert streams.restart(first_run=3).antithetic
+
+
+def test_random_streams_qmc():
+    pytest.importorskip("scipy")
+    streams = RandomStreams(seed=42, runs=1024, qmc=True, horizon=20, drivers={"inflation": "standard_normal", "job": "random"})
+    normals = np.array([streams.normal("inflation") for i in range(20)])
+    uniforms = np.array([streams.uniform("job") for i in range(20)])
+    assert normals.mean() == pytest.approx(0, abs=0.01) and normals.std() == pytest.approx(1, abs=0.01)
+    assert uniforms.mean() == pytest.approx(0.5, abs=0.01) and 0 < uniforms.min() and uniforms.max() < 1
+    assert abs(np.corrcoef(normals[0], normals[19])[0, 1]) < 0.1
+    with pytest.raises(ValueError):
+        streams.normal("inflation")
+    # other streams are not part of the Sobol points
+    assert len(set(streams.normal("asset"))) == 1024
+
+    # points by run number
+    single = RandomStreams(seed=42, first_run=7, qmc=True, horizon=20, drivers={"job": "random", "inflation": "standard_normal"})
+    assert [single.normal("inflation") for i in range(20)] == pytest.approx(normals[:, 7])
+
+
+def test_brownian_bridge_order():
+    order = get_brownian_bridge_order(10)
+    assert order[:3] == [(10, None, None), (5, 0, 10), (2, 0, 5)]
+    assert sorted(year for year, _, _ in order) == list(range(1, 11))
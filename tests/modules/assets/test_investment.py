@@ -1,7 +1,7 @@
 import pytest
-import random
 
 from fup.core.config import BluePrint
+from fup.core.streams import RandomStreams
 from fup.modules.assets.investment import Standard
 
 
@@ -25,7 +25,7 @@ def test_standard(default_manager):
     assert default_manager.df_row["test"] == pytest.approx(1000 * 1.1 * (1 - 0.01))
     assert default_manager.total_assets == pytest.approx((1000 * 1.1) * (1 - 0.01))
     # random
-    random.seed(42)
+    default_manager.random = RandomStreams(seed=42)
     default_manager.config["simulation"]["random"] = True
     default_manager.next_year()
-    assert default_manager.total_assets == pytest.approx(1179.70, 1e-5)
+    assert default_manager.total_assets == pytest.approx(1064.76, 1e-5)
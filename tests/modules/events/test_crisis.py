@@ -1,13 +1,16 @@
+import numpy as np
 import pytest
-import random
 import pandas as pd
 
 from fup.core.config import BluePrint
+from fup.core.manager import Manager
+from fup.core.streams import RandomStreams
 from fup.core.module import AssetModule
 from fup.modules.main.environment import Inflation
 from fup.modules.main.work import Job
 from fup.modules.main.expenses import InflationSensitive
-from fup.modules.events.crisis import OilCrisis1973, LostDecadeJapan1991, GreatRecession2007, GermanHyperinflation1914
+from fup.modules.assets.bank import CurrentAccount
+from fup.modules.events.crisis import TableCrisis, load_crisis_tables, OilCrisis1973, LostDecadeJapan1991, GreatRecession2007, GermanHyperinflation1914
 
 
 def test_german_hyperinflation_1914(default_manager):
@@ -183,7 +186,7 @@ def test_oil_crisis_1973_fixed_year(default_manager):
 def test_oil_crisis_1973_random(default_manager):
     manager = default_manager
     default_manager.config["simulation"]["random"] = True
-    random.seed(42)
+    default_manager.random = RandomStreams(seed=42)
 
     crisis_config = {
         "probability": 0.3
@@ -216,3 +219,46 @@ def test_oil_crisis_1973_random(default_manager):
     assert df["inflation"].max() == pytest.approx(1.123)
     assert default_manager.get_module("assets.resources.Gold").money_value == pytest.approx(825)
     assert default_manager.get_module("assets.stocks.Stocks").money_value == pytest.approx(325.39682539)
+
+
+def test_crisis_tables():
+    tables = load_crisis_tables()
+    assert {name: table.end_year for name, table in tables.items()} == {
+        "OilCrisis1973": 4, "LostDecadeJapan1991": 18, "GreatRecession2007": 6, "GermanHyperinflation1914": 7}
+    table = tables["LostDecadeJapan1991"]
+    stocks = table.targets.index(("assets.stocks.Stocks", "asset_value"))
+    assert list(table.numerators[:, stocks]) == [1.205] * 3 + [0.71] * 2 + [0.975] * 13 + [1, 1]
+    assert table.has_effect[:, stocks].sum() == 18
+
+
+def test_table_crisis_batch(default_config, default_profile_blueprint):
+    default_config["simulation"]["random"] = True
+    crisis_config = {
+        "probability": 0.3,
+        "table": {0: {"assets.stocks.Stocks": {"asset_value": 0.5}},
+                  "1-2": {"assets.stocks.Stocks": {"asset_value": [3, "assets.resources.Gold.asset_value"]}},
+                  3: {"assets.stocks.Stocks": {"asset_value": [1, 1.125]}}},
+    }
+    module_blueprints = [
+        BluePrint(name="CurrentAccount", build_config={"start_money_value": 0}, build_class=CurrentAccount),
+        BluePrint(name="assets.resources.Gold", build_config={}, build_class=AssetModule),
+        BluePrint(name="assets.stocks.Stocks", build_config={}, build_class=AssetModule),
+        BluePrint(name="crisis", build_config=crisis_config, build_class=TableCrisis),
+    ]
+    managers = [Manager(config=default_config, profile_blueprint=default_profile_blueprint,
+                        current_account_name="CurrentAccount", module_blueprints=module_blueprints, seed=42,
+                        runs=runs, first_run=first_run) for runs, first_run in [(100, 0), (None, 0), (None, 57)]]
+    for manager in managers:
+        manager.get_module("assets.resources.Gold").asset_value = 2
+    stocks = []
+    for i in range(10):
+        for manager in managers:
+            manager.next_year()
+        stocks += [[manager.get_module("assets.stocks.Stocks").asset_value for manager in managers]]
+
+    # runs in different years of the crisis share one row gather, same values as single runs
+    batch_stocks = np.array([values[0] for values in stocks])
+    assert len(np.unique(batch_stocks[-1])) == 4  # every year of the crisis (or none)
+    assert set(np.unique(batch_stocks)) == {1, 0.5, 0.75, 1.125}
+    assert [values[1] for values in stocks] == pytest.approx(batch_stocks[:, 0])
+    assert [values[2] for values in stocks] == pytest.approx(batch_stocks[:, 57])
@@ -1,9 +1,10 @@
 import pytest
+import numpy as np
 
 from fup.core.config import BluePrint
 from fup.core.module import Module
 from fup.modules.main.environment import Inflation
-from fup.modules.main.taxes import Taxes
+from fup.modules.main.taxes import Taxes, interpolate_tax_rate
 from fup.modules.main.insurances import Health, Pension, NursingCare, Unemployment
 
 # https://www.brutto-netto-rechner.info/
@@ -166,3 +167,14 @@ def test_church_tax(default_manager):
     default_manager.next_year()
 
     assert default_manager.df_row["tax"] == pytest.approx(income*0.2*1.08)
+
+
+def test_interpolate_tax_rate():
+    thresholds = np.array([10000., 20000., 50000.])
+    tax_rates = np.array([0., 0.2, 0.4])
+    assert interpolate_tax_rate(15000, thresholds, tax_rates) == pytest.approx(0.1)
+    tax_rate = interpolate_tax_rate(np.array([0, 15000, 35000, 1e6]), thresholds, tax_rates)
+    assert tax_rate.tolist() == pytest.approx([0, 0.1, 0.3, 0.4])
+    # thresholds scaled by the inflation since the start, per run
+    tax_rate = interpolate_tax_rate(np.array([30000, 30000]), thresholds, tax_rates, inflation_index=np.array([1, 2]))
+    assert tax_rate.tolist() == pytest.approx([0.2 + 0.2 / 3, 0.1])
@@ -1,9 +1,10 @@
-import random
 import pytest
+import numpy as np
 
 from fup.core.config import BluePrint
+from fup.core.streams import RandomStreams
 from fup.modules.main.environment import Inflation
-from fup.modules.main.work import Job
+from fup.modules.main.work import Job, draw_employment_year
 
 
 def test_income_and_unemployment(default_manager):
@@ -22,20 +23,20 @@ def test_income_and_unemployment(default_manager):
     assert default_manager.df_row["income"] == pytest.approx(30000 * inflation_mean * 1.0227)
 
     default_manager.config["simulation"]["random"] = True
-    random.seed(42)
+    default_manager.random = RandomStreams(seed=42)
     default_manager.next_year()
     assert default_manager.get_module("Job").unemployed_months == 12
     assert default_manager.get_module("Job").unemployed_months_this_year == 12
     assert default_manager.df_row["income"] == pytest.approx(0)
 
     # FIXME highly unstable test with several random numbers!
-    random.seed(42)
+    default_manager.random = RandomStreams(seed=42)
     default_manager.get_module("Job").prob_find_job = 0.1
     default_manager.get_module("Job").prob_lose_job = 0
     default_manager.next_year()
-    assert default_manager.get_module("Job").unemployed_months_this_year == 5
+    assert default_manager.get_module("Job").unemployed_months_this_year == 3
     assert default_manager.get_module("Job").unemployed_months == 0
-    assert default_manager.df_row["income"] == pytest.approx((inflation_mean * 1.0227) ** 3 * 30000 * (12 - 5) / 12)
+    assert default_manager.df_row["income"] == pytest.approx((inflation_mean * 1.0227) ** 3 * 30000 * (12 - 3) / 12)
 
     # TODO No Money when retired ?! part time Job??!
     default_manager.profile.retired = True
@@ -64,3 +65,37 @@ def test_salary_increase(default_manager):
         else:
             assert default_manager.df_row["income"] == pytest.approx(last_income * 0.993 * inflation_mean), i
         last_income = default_manager.df_row["income"]
+    # plain floats in single runs
+    assert type(default_manager.get_module("Job").get_age_salary_increase()) is float
+    assert type(default_manager.get_module("Job").salary_per_month) is float
+
+
+def test_draw_employment_year():
+    rng = np.random.default_rng(42)
+    runs = 100000
+    start_months = np.repeat([0, 5], runs // 2)
+    prob_lose_job = np.repeat([0.05, 0.02], runs // 2)
+    prob_find_job = 0.2
+
+    # monthly chain
+    unemployed_months = start_months.copy()
+    unemployed_months_this_year = np.zeros(runs, dtype=int)
+    for month in range(12):
+        draw = rng.random(runs)
+        unemployed_months = np.where(unemployed_months > 0, np.where(draw < prob_find_job, 0, unemployed_months + 1),
+                                     np.where(draw < prob_lose_job, 1, 0))
+        unemployed_months_this_year += unemployed_months > 0
+
+    end_months, months_this_year = draw_employment_year(start_months, prob_lose_job, prob_find_job, rng.random(runs))
+    for expected, drawn in [(unemployed_months, end_months), (unemployed_months_this_year, months_this_year)]:
+        for half in [slice(None, runs // 2), slice(runs // 2, None)]:
+            assert drawn[half].mean() == pytest.approx(expected[half].mean(), abs=0.05)
+            assert (drawn[half] == 0).mean() == pytest.approx((expected[half] == 0).mean(), abs=0.01)
+    assert end_months.max() == 17
+
+    # single runs give the same as the batch
+    for i in [0, 1, runs - 1]:
+        draw = (i + 0.5) / runs
+        batch = draw_employment_year(start_months, prob_lose_job, prob_find_job, np.full(runs, draw))
+        assert draw_employment_year(start_months[i], prob_lose_job[i], prob_find_job, draw) == \
+            (batch[0][i], batch[1][i])
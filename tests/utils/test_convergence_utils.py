@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from fup.utils.convergence_utils import MonteCarloStatistic, run_until_converged
+
+
+def test_monte_carlo_statistic():
+    values = np.random.default_rng(42).normal(10, 2, size=10000)
+    estimate, std_error, low, high = MonteCarloStatistic("mean", column="x").estimate(values)
+    assert std_error == pytest.approx(0.02, rel=0.05)
+    assert low < 10 < high
+    assert high - low == pytest.approx(2 * 1.96 * std_error, rel=1e-3)
+
+    p, _, low, high = MonteCarloStatistic("p", column="x", below=10).estimate(values)
+    assert low < 0.5 < high and low < p < high
+
+    median, _, low, high = MonteCarloStatistic("median", column="x", quantile=0.5).estimate(values)
+    assert low < 10 < high and low <= median <= high
+
+    # no bankruptcy in any run still has an uncertainty
+    _, _, low, high = MonteCarloStatistic("p", column="x", below=0).estimate(values)
+    assert low == pytest.approx(0) and 0 < high < 1e-3
+
+
+def test_run_until_converged(modules_config):
+    modules_config["simulation"]["random"] = True
+    modules_config["simulation"]["seed"] = 42
+    statistics = [MonteCarloStatistic("assets", column="assets_cor", precision=1e12),
+                  MonteCarloStatistic("expenses", column="expenses_net_cor", over_years="mean", quantile=0.5)]
+    df, report = run_until_converged(config=modules_config, statistics=statistics, max_runs=100, chunk_size=10)
+    assert len(df.run.unique()) == 10
+    assert list(report["runs"]) == [10, 10]
+    assert report["converged"].all()
+
+    statistics = [MonteCarloStatistic("assets", column="assets_cor", precision=0)]
+    df, report = run_until_converged(config=modules_config, statistics=statistics, max_runs=30, chunk_size=10)
+    assert len(df.run.unique()) == 30
+    assert not report["converged"].any()
+    assert report["ci_low"].iloc[0] < report["estimate"].iloc[0] < report["ci_high"].iloc[0]
+
+
+def test_run_until_converged_variance_reduction(modules_config):
+    modules_config["simulation"]["random"] = True
+    modules_config["simulation"]["seed"] = 42
+    modules_config["simulation"]["antithetic"] = True
+    modules_config["simulation"]["control_variates"] = True
+    statistics = [MonteCarloStatistic("assets", column="assets_cor"),
+                  MonteCarloStatistic("assets median", column="assets_cor", quantile=0.5),
+                  MonteCarloStatistic("poor", column="assets_cor", below=0)]
+    df, report = run_until_converged(config=modules_config, statistics=statistics, max_runs=20, chunk_size=10)
+    assert "control.main.environment.Inflation" in df.columns
+    np.testing.assert_allclose(df.groupby("year")["control.main.environment.Inflation"].sum(), 0, atol=1e-9)
+    assert (report["ci_low"] <= report["estimate"]).all() and (report["estimate"] <= report["ci_high"]).all()
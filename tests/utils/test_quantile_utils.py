@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from fup.utils.quantile_utils import QuantileSketch, QuantileAggregator, get_weighted_percentiles
+from fup.utils.plot_utils import get_percentiles
+from fup.utils.simulation_utils import run_simulations
+
+
+def test_quantile_sketch():
+    rng = np.random.default_rng(42)
+    values = np.stack([rng.normal(size=20000), rng.exponential(size=20000)], axis=1)
+    sketch = QuantileSketch(cells=2, compression=100)
+    for batch in np.split(values, 20):
+        sketch.update(batch)
+    assert sketch.count == pytest.approx([20000, 20000])
+    assert sketch.weights.shape == (2, 100)
+
+    quantiles = [0, 0.05, 0.25, 0.5, 0.75, 0.95, 1]
+    expected = np.percentile(values, np.array(quantiles) * 100, axis=0).T
+    assert sketch.quantile(quantiles) == pytest.approx(expected, abs=0.02)
+
+    # single observations
+    sketch = QuantileSketch(cells=2, compression=100)
+    for observation in values[:1000]:
+        sketch.update(observation)
+    assert sketch.quantile(0.5)[:, 0] == pytest.approx(np.median(values[:1000], axis=0), abs=0.05)
+
+
+def test_quantile_aggregator(modules_config):
+    modules_config["simulation"]["random"] = True
+    modules_config["simulation"]["seed"] = 42
+    aggregator = QuantileAggregator(columns=["assets_cor", "expenses_net_cor"])
+    df, df_stats = run_simulations(config=modules_config, runs=200, batch=True, chunk_size=50, aggregator=aggregator)
+    assert aggregator.runs == 200
+
+    dfg = get_percentiles(df=aggregator, column="assets_cor")
+    dfg_expected = get_percentiles(df=df, column="assets_cor")
+    assert list(dfg.columns) == list(dfg_expected.columns)
+    assert list(dfg[("year", "")]) == list(dfg_expected[("year", "")])
+    for p in [5, 25, 50, 75, 95]:
+        assert dfg["assets_cor"][f"percentile_{p}"].values == \
+               pytest.approx(dfg_expected["assets_cor"][f"percentile_{p}"].values, rel=0.02)
+
+    df, df_stats = run_simulations(config=modules_config, runs=10, aggregator=QuantileAggregator(),
+                                   keep_results=False)
+    assert df is None
+
+
+def test_get_weighted_percentiles():
+    values = np.random.default_rng(42).normal(size=(20000, 2))
+    weights = np.ones(20000)
+    assert get_weighted_percentiles(values, weights, [5, 50, 95]) == \
+        pytest.approx(np.percentile(values, [5, 50, 95], axis=0).T, abs=0.02)
+
+    # a heavy observation pulls the percentiles towards it
+    values = np.array([4., 3., 2., 1.])
+    assert get_weighted_percentiles(values, np.array([1, 1, 1, 1]), [50])[0] == pytest.approx([2.5])
+    assert get_weighted_percentiles(values, np.array([1, 1, 10, 1]), [50])[0] == pytest.approx([2.09], abs=0.01)
@@ -1,5 +1,20 @@
+import copy
+import json
+import os
 import pytest
-from fup.utils.simulation_utils import overwrite_config, get_sorted_module_blueprints, get_start_values, run_simulations
+import pandas as pd
+import numpy as np
+from ruamel.yaml import YAML
+from fup.core.manager import Manager
+from fup.core.functions import get_blueprint, get_module_blueprints
+from fup.core.streams import DriverTape
+from fup.utils.simulation_utils import overwrite_config, get_sorted_module_blueprints, get_start_values, \
+    run_simulations, run_sweep, get_config_fingerprint, get_scenario_summary, generate_driver_tape, \
+    get_sorted_module_names, get_dependency_graph, _sorted_module_names_cache
+from fup.utils.store_utils import ResultStore
+import fup.modules
+import fup.profiles
+import fup.utils.simulation_utils
 
 
 def test_overwrite_config():
@@ -37,6 +52,57 @@ def test_get_sorted_module_blueprints(modules_config):
     assert sorted_module_config_list[5].name == "CurrentAccount"
 
 
+def test_feedback_free_modules(modules_config):
+    modules_config["simulation"].update(random=True, seed=42, control_variates=True)
+    module_blueprints = get_sorted_module_blueprints(modules_config)
+    assert {blueprint.name for blueprint in module_blueprints if blueprint.feedback_free} == \
+        {"stocks", "main.environment.Inflation"}
+
+    # all years ahead give the same numbers as year by year
+    managers = []
+    for feedback_free in [True, False]:
+        for blueprint in module_blueprints:
+            blueprint.feedback_free = blueprint.feedback_free and feedback_free
+        managers += [Manager(config=modules_config, module_blueprints=module_blueprints, runs=3, seed=42,
+                             profile_blueprint=get_blueprint(config=modules_config["profile"], root_module=fup.profiles),
+                             current_account_name="CurrentAccount")]
+    assert managers[0].feedback_free_modules and not managers[1].feedback_free_modules
+    for i in range(20):
+        for manager in managers:
+            manager.next_year()
+        for column in ["inflation", "total_inflation", "assets", "control.stocks"]:
+            assert np.array_equal(managers[0].df_row[column], managers[1].df_row[column]), column
+
+    # modified by an event
+    modules_config["modules"]["crisis"] = {"class": "events.crisis.TableCrisis", "probability": 0.1,
+                                           "table": {0: {"main.environment.Inflation": {"inflation_mean": 1.1}}}}
+    assert {blueprint.name for blueprint in get_sorted_module_blueprints(modules_config) if blueprint.feedback_free} \
+        == {"stocks"}
+
+
+def test_declared_dependencies():
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", "config_template.yaml")) as f:
+        config = YAML(typ="safe").load(f)
+    module_blueprints = get_sorted_module_blueprints(config)
+    sorted_names = [blueprint.name for blueprint in module_blueprints]
+    assert sorted_names[-2:] == ["main.investing.Investing", "CurrentAccount"]  # end of year phase
+    assert sorted_names.index("crisis_2035") < sorted_names.index("main.environment.Inflation") \
+        < sorted_names.index("main.work.Job") < sorted_names.index("main.insurances.NursingCare")
+    # the modules link to no other modules than they declare, checked by the manager
+    Manager(config=config, module_blueprints=module_blueprints, current_account_name="CurrentAccount",
+            profile_blueprint=get_blueprint(config=config["profile"], root_module=fup.profiles))
+
+    # the current account under another name, first in the config
+    config["modules"] = dict(account=config["modules"].pop("CurrentAccount"), **config["modules"])
+    module_blueprints = get_module_blueprints(config=config, root_module=fup.modules)
+    assert get_dependency_graph(module_blueprints, current_account_name="account").has_edge(
+        "main.investing.Investing", "account")
+    sorted_names = get_sorted_module_names(module_blueprints, current_account_name="account")
+    assert sorted_names[-2:] == ["main.investing.Investing", "account"]
+    Manager(config=config, module_blueprints=module_blueprints, current_account_name="account",
+            profile_blueprint=get_blueprint(config=config["profile"], root_module=fup.profiles))
+
+
 def test_get_start_values(modules_config):
     df = get_start_values(config=modules_config)
     # Don't do tax calculation check here
@@ -54,3 +120,212 @@ def test_run_simulations(modules_config):
     assert "run" in df.columns
     assert list(df["run"].unique()) == [0, 1]
     assert len(df) == pytest.approx(2 * 20)
+
+
+def test_run_simulations_batch(modules_config):
+    df, df_stats = run_simulations(config=modules_config, runs=2)
+    df_batch, df_stats = run_simulations(config=modules_config, runs=2, batch=True)
+    assert sorted(df_batch.columns) == sorted(df.columns)
+    assert list(df_batch["run"].unique()) == [0, 1]
+    for column in df.columns:
+        assert df_batch[column].values == pytest.approx(df[column].values), column
+
+    modules_config["simulation"]["random"] = True
+    modules_config["simulation"]["seed"] = 42
+    df, df_stats = run_simulations(config=modules_config, runs=3)
+    df_batch, df_stats = run_simulations(config=modules_config, runs=3, batch=True)
+    assert len(df_batch) == 3 * 20
+    assert df_batch.query("year == 2020")["assets"].nunique() == 3
+    for column in df.columns:
+        assert df_batch[column].values == pytest.approx(df[column].values), column
+
+
+def test_run_simulations_workers(modules_config):
+    modules_config["simulation"]["random"] = True
+    modules_config["simulation"]["seed"] = 42
+    df, df_stats = run_simulations(config=modules_config, runs=5)
+    df_workers, df_stats = run_simulations(config=modules_config, runs=5, workers=2, chunk_size=2)
+    assert list(df_workers["run"].unique()) == [0, 1, 2, 3, 4]
+    pd.testing.assert_frame_equal(df, df_workers)
+    # every run can be repeated on its own
+    df_single, df_stats = run_simulations(config=modules_config, runs=1)
+    assert df_single["assets"].values == pytest.approx(df.query("run == 0")["assets"].values)
+
+
+def test_run_simulations_streaming_chunks(modules_config, monkeypatch):
+    class CountingAggregator:
+        def __init__(self):
+            self.runs = []
+
+        def update(self, result):
+            self.runs += [result.runs]
+
+    monkeypatch.setattr(fup.utils.simulation_utils, "STREAMING_CHUNK_SIZE", 2)
+    aggregator = CountingAggregator()
+    result, df_stats = run_simulations(config=modules_config, runs=5, aggregator=aggregator, keep_results=False)
+    assert result is None
+    assert aggregator.runs == [2, 2, 1]
+    # a given chunk size is kept
+    aggregator = CountingAggregator()
+    run_simulations(config=modules_config, runs=5, chunk_size=5, aggregator=aggregator)
+    assert aggregator.runs == [5]
+
+
+def test_run_simulations_result(modules_config):
+    df, df_stats = run_simulations(config=modules_config, runs=2)
+    result, df_stats = run_simulations(config=modules_config, runs=2, as_dataframe=False)
+    assert result["assets_cor"].shape == (2, 20)
+    assert list(result.years) == list(range(2001, 2021))
+    pd.testing.assert_frame_equal(result.to_dataframe(), df)
+
+
+def test_get_sorted_module_blueprints_cache(modules_config, monkeypatch):
+    sortings = []
+    get_sorted_module_names = fup.utils.simulation_utils.get_sorted_module_names
+    monkeypatch.setattr(fup.utils.simulation_utils, "get_sorted_module_names",
+                        lambda module_blueprints: sortings.append(1) or get_sorted_module_names(module_blueprints))
+    fingerprint = get_config_fingerprint(modules_config)
+    _sorted_module_names_cache.pop(fingerprint, None)
+
+    sorted_names = [blueprint.name for blueprint in get_sorted_module_blueprints(modules_config)]
+    assert len(sortings) == 1
+    # only numbers changed
+    config = copy.deepcopy(modules_config)
+    config["modules"]["Job"]["start_income"] = 1000
+    config["modules"]["main.investing.Investing"]["assets_ratios"]["stocks"] = 0.9
+    assert get_config_fingerprint(config) == fingerprint
+    sorted_module_blueprints = get_sorted_module_blueprints(config)
+    assert len(sortings) == 1
+    assert [blueprint.name for blueprint in sorted_module_blueprints] == sorted_names
+    assert sorted_module_blueprints[2].build_config["start_income"] == 1000
+
+    # structure changed
+    config["modules"]["main.taxes.Taxes"]["taxable_incomes"] = []
+    assert get_config_fingerprint(config) != fingerprint
+    config["modules"]["Job"]["class"] = "main.expenses.InflationSensitive"
+    assert get_config_fingerprint(config) != fingerprint
+
+
+def test_run_sweep(modules_config):
+    modules_config["simulation"]["random"] = True
+    grid = {("modules", "Job", "start_income"): [30000, 60000],
+            ("modules", "main.investing.Investing", "assets_ratios", "stocks"): [0., 0.5]}
+    scenarios = [dict(name="no job", config={"modules": {"Job": {"start_income": 0}}})]
+    df = run_sweep(modules_config, grid=grid, scenarios=scenarios, runs=3)
+    assert list(df["name"]) == ["no job", "start_income=30000, stocks=0.0", "start_income=30000, stocks=0.5",
+                                "start_income=60000, stocks=0.0", "start_income=60000, stocks=0.5"]
+    assert df["start_income"].tolist()[1:] == [30000, 30000, 60000, 60000]
+    assert set(df.columns) >= {"runs", "bankruptcy_rate", "mean_savings_at_end", "mean_expenses"}
+    assert df["mean_savings_at_end"].iloc[0] < df["mean_savings_at_end"].iloc[1] < df["mean_savings_at_end"].iloc[3]
+    # same result in a process pool
+    modules_config["simulation"]["seed"] = 1
+    pd.testing.assert_frame_equal(run_sweep(modules_config, grid=grid, runs=3, workers=2),
+                                  run_sweep(modules_config, grid=grid, runs=3))
+
+
+def test_run_simulations_checkpoint(modules_config, tmp_path, monkeypatch):
+    import fup.utils.simulation_utils
+    modules_config["simulation"]["random"] = True
+    checkpoint = str(tmp_path / "checkpoint")
+    simulate_runs = fup.utils.simulation_utils.simulate_runs
+    calls = []
+
+    def interrupted_simulate_runs(**kwargs):
+        calls.append(kwargs["first_run"])
+        if len(calls) > 2:
+            raise KeyboardInterrupt()
+        return simulate_runs(**kwargs)
+
+    # without seed in the config, the seed is saved with the checkpoint
+    monkeypatch.setattr(fup.utils.simulation_utils, "simulate_runs", interrupted_simulate_runs)
+    with pytest.raises(KeyboardInterrupt):
+        run_simulations(config=modules_config, runs=10, chunk_size=3, checkpoint=checkpoint)
+    monkeypatch.setattr(fup.utils.simulation_utils, "simulate_runs", simulate_runs)
+
+    df, _ = run_simulations(config=modules_config, runs=10, chunk_size=3, checkpoint=checkpoint)
+    seed = ResultStore(checkpoint).metadata["job"]["seed"]
+    config = copy.deepcopy(modules_config)
+    config["simulation"]["seed"] = seed
+    df_expected, _ = run_simulations(config=config, runs=10, chunk_size=3)
+    pd.testing.assert_frame_equal(df, df_expected)
+
+    # only the missing chunks are simulated
+    monkeypatch.setattr(fup.utils.simulation_utils, "simulate_runs", interrupted_simulate_runs)
+    calls.clear()
+    run_simulations(config=modules_config, runs=10, chunk_size=3, checkpoint=checkpoint)
+    assert calls == []
+    with pytest.raises(ValueError):
+        run_simulations(config=modules_config, runs=12, chunk_size=3, checkpoint=checkpoint)
+
+
+def test_run_sweep_checkpoint(modules_config, tmp_path):
+    modules_config["simulation"]["random"] = True
+    checkpoint = str(tmp_path / "sweep.json")
+    grid = {("modules", "Job", "start_income"): [30000, 45000, 60000]}
+    summaries = []
+
+    def interrupted_summary(result):
+        summaries.append(1)
+        if len(summaries) == 2:
+            raise KeyboardInterrupt()
+        return get_scenario_summary(result)
+
+    with pytest.raises(KeyboardInterrupt):
+        run_sweep(modules_config, grid=grid, runs=3, summary=interrupted_summary, checkpoint=checkpoint)
+    df = run_sweep(modules_config, grid=grid, runs=3, summary=interrupted_summary, checkpoint=checkpoint)
+    assert len(summaries) == 4
+
+    with open(checkpoint) as f:
+        modules_config["simulation"]["seed"] = json.load(f)["job"]["seed"]
+    pd.testing.assert_frame_equal(df, run_sweep(modules_config, grid=grid, runs=3))
+
+
+def test_run_simulations_importance_sampling():
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", "config_template.yaml")) as f:
+        config = YAML(typ="safe").load(f)
+    config["simulation"].update(seed=42, end_year=config["simulation"]["start_year"] + 20)
+    config["modules"] = {name: module_config for name, module_config in config["modules"].items()
+                         if not module_config.get("start_year")}
+    config["modules"]["events.crisis.OilCrisis1973"]["probability"] = 0.05
+    config["simulation"]["importance_sampling"] = {"event_hazard": 2, "return_shift": -1}
+    df, _ = run_simulations(config=config, runs=6)
+    df_batch, _ = run_simulations(config=config, runs=6, batch=True)
+    assert df_batch["likelihood_ratio"].values == pytest.approx(df["likelihood_ratio"].values)
+
+    result, _ = run_simulations(config=config, runs=2000, batch=True, as_dataframe=False)
+    likelihood_ratios = result["likelihood_ratio"][:, -1]
+    assert likelihood_ratios.mean() == pytest.approx(1, abs=0.1)
+    assert 0.1 < (result["event"][:, -1] != None).mean()  # noqa: E711
+    # weighted, the events happen with their original probability
+    started = (result["event"] != None).any(axis=1)  # noqa: E711
+    assert np.average(started, weights=likelihood_ratios) == pytest.approx(1 - 0.95 ** 20, abs=0.05)
+    summary = get_scenario_summary(result)
+    assert summary["bankruptcy_rate"] == np.average(result["assets_cor"].min(axis=1) < 0, weights=likelihood_ratios)
+
+
+def test_driver_tape(modules_config, tmp_path):
+    modules_config["simulation"]["random"] = True
+    modules_config["simulation"]["seed"] = 42
+    tape = generate_driver_tape(modules_config, runs=6)
+    assert sorted(tape.arrays) == [("Job", "random"), ("main.environment.Inflation", "standard_normal"),
+                                   ("stocks", "standard_normal")]
+    result, _ = run_simulations(config=modules_config, runs=6, as_dataframe=False)
+    for batch in [False, True]:
+        replayed, _ = run_simulations(config=modules_config, runs=6, batch=batch, as_dataframe=False, tape=tape)
+        np.testing.assert_array_equal(replayed.values, result.values)
+
+    # memory-mapped, opened again by the workers
+    tape = generate_driver_tape(modules_config, runs=6, path=str(tmp_path))
+    assert DriverTape.load(str(tmp_path)).runs == 6
+    replayed, _ = run_simulations(config=modules_config, runs=6, as_dataframe=False, tape=tape, workers=2)
+    np.testing.assert_array_equal(replayed.values, result.values)
+
+    with pytest.raises(ValueError):
+        run_simulations(config=modules_config, runs=7, tape=tape)
+    modules_config["simulation"]["seed"] = 43
+    with pytest.raises(ValueError):
+        run_simulations(config=modules_config, runs=6, tape=tape)
+
+    grid = {("modules", "main.investing.Investing", "assets_ratios", "stocks"): [0.2, 0.8]}
+    df = run_sweep(modules_config, grid=grid, runs=4)
+    pd.testing.assert_frame_equal(run_sweep(modules_config, grid=grid, runs=4, tape=True), df)
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from fup.utils.plot_utils import get_percentiles
+from fup.utils.simulation_utils import run_simulations
+from fup.utils.store_utils import ResultStore
+import fup.utils.simulation_utils
+
+
+def test_result_store(modules_config, tmp_path):
+    modules_config["simulation"]["random"] = True
+    modules_config["simulation"]["seed"] = 42
+    result, _ = run_simulations(config=modules_config, runs=10, as_dataframe=False)
+
+    store = ResultStore(path=str(tmp_path))
+    run_simulations(config=modules_config, runs=10, chunk_size=3, keep_results=False, store=store)
+    assert store.shards == [(0, 3), (3, 3), (6, 3), (9, 1)]
+    assert store.runs == 10
+    assert list(store.years) == list(result.years)
+    np.testing.assert_array_equal(store["assets_cor"], result["assets_cor"])
+    np.testing.assert_array_equal(store.get("income", runs=slice(2, 8), years=slice(5, 7)),
+                                  result["income"][2:8, 5:7])
+    np.testing.assert_array_equal(store.get("tax", runs=[9, 0, 4]), result["tax"][[0, 4, 9]])
+
+    # read back from disk
+    store = ResultStore(path=str(tmp_path))
+    assert store.runs == 10
+    assert list(store.run_numbers) == list(range(10))
+    df = get_percentiles(store, column="assets")
+    df_expected = get_percentiles(result.to_dataframe(), column="assets")
+    pd.testing.assert_frame_equal(df.reset_index(drop=True), df_expected, check_dtype=False)
+    assert df["assets"]["percentile_50"].iloc[-1] == pytest.approx(np.median(result["assets"][:, -1]))
+
+
+def test_result_store_streaming_chunks(modules_config, tmp_path, monkeypatch):
+    monkeypatch.setattr(fup.utils.simulation_utils, "STREAMING_CHUNK_SIZE", 2)
+    store = ResultStore(path=str(tmp_path))
+    result, _ = run_simulations(config=modules_config, runs=5, as_dataframe=False, store=store)
+    assert store.shards == [(0, 2), (2, 2), (4, 1)]
+    assert result.runs == 5
+
+
+def test_result_store_overlapping_runs(modules_config, tmp_path):
+    store = ResultStore(path=str(tmp_path))
+    run_simulations(config=modules_config, runs=3, store=store)
+    with pytest.raises(ValueError):
+        run_simulations(config=modules_config, runs=3, store=store)
+    store = ResultStore(path=str(tmp_path))
+    with pytest.raises(ValueError):
+        run_simulations(config=modules_config, runs=5, store=store)
+    assert store.shards == [(0, 3)]
+    assert list(store.run_numbers) == [0, 1, 2]